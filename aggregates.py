@@ -0,0 +1,78 @@
+import pandas as pd
+
+import notes
+import telemetry
+
+
+# 統計摘要：總分鐘、各音符分鐘/最高/平均 BPM、有練習的日期
+# 整份載入時用 groupby 建一次，之後只把新增的記錄加進來 (add_frame)
+class HistoryIndex:
+    def __init__(self):
+        self.total_minutes = 0.0
+        self.count = 0
+        # Note_Type 標準標籤 -> [分鐘, 最高 BPM, BPM 總和, 筆數, SPS 總和]
+        self.per_note = {}
+        self.days = set()
+
+    @classmethod
+    def from_frame(cls, df):
+        index = cls()
+        index.add_frame(df)
+        return index
+
+    @telemetry.timed("aggregates.add_frame")
+    def add_frame(self, df):
+        if df.empty:
+            return
+        self.total_minutes += float(df['Duration'].sum())
+        self.count += len(df)
+        grouped = df.groupby(notes.normalize(df['Note_Type']), observed=True).agg(
+            minutes=('Duration', 'sum'), max_bpm=('BPM', 'max'), bpm_sum=('BPM', 'sum'), n=('BPM', 'size'),
+            sps_sum=('SPS', 'sum'))
+        for label, row in grouped.iterrows():
+            self._merge(label, row['minutes'], row['max_bpm'], row['bpm_sum'], row['n'], row['sps_sum'])
+        self.days.update(df['Date'].dt.date.unique())
+
+    def _merge(self, label, minutes, max_bpm, bpm_sum, n, sps_sum):
+        stats = self.per_note.setdefault(label, [0.0, 0.0, 0.0, 0, 0.0])
+        stats[0] += float(minutes)
+        stats[1] = max(stats[1], float(max_bpm))
+        stats[2] += float(bpm_sum)
+        stats[3] += int(n)
+        stats[4] += float(sps_sum)
+
+    def version(self):
+        # 歷史內容的指紋，當作衍生資料 (趨勢圖、進度分析) 的快取鍵
+        # 各音符的分鐘 / BPM / SPS 總和：只改 BPM 或 SPS、或把時間從一種音符移到另一種，指紋都會變
+        per_note = tuple(sorted((str(label), round(s[0], 6), round(s[2], 6), round(s[4], 6))
+                                for label, s in self.per_note.items()))
+        return (self.count, round(self.total_minutes, 6), len(self.days), per_note)
+
+    # --- 查詢 (標籤已統一，直接查表，跟記錄筆數無關) ---
+    def _matching(self, note):
+        if note is None:
+            return list(self.per_note.values())
+        stats = self.per_note.get(notes.canonical(note))
+        return [stats] if stats else []
+
+    def minutes(self, note=None):
+        if note is None:
+            return self.total_minutes
+        return sum(s[0] for s in self._matching(note))
+
+    def max_bpm(self, note=None):
+        return max((s[1] for s in self._matching(note)), default=0)
+
+    def mean_bpm(self, note=None):
+        matched = self._matching(note)
+        n = sum(s[3] for s in matched)
+        return sum(s[2] for s in matched) / n if n else 0
+
+    def sessions(self, note=None):
+        return sum(s[3] for s in self._matching(note))
+
+    @telemetry.timed("aggregates.best_by_note")
+    def best_by_note(self):
+        # 依登錄表順序 (1/4, 1/8, 1/3, 1/16)
+        rows = [(label, self.per_note[label][1]) for label in notes.NOTE_LABELS if label in self.per_note]
+        return pd.DataFrame(rows, columns=['Note_Type', 'BPM'])
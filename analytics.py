@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+import notes
+import telemetry
+
+# --- 練習分析 ---
+# 以「日」為單位的向量運算：每天最佳 BPM -> 個人紀錄 (累計最高) 與近 N 天最佳，
+# 升級預估 (快嘴每 120 分鐘一級)、停滯期 (連續 N 天以上沒刷新個人紀錄)、SPS 百分位
+# 全部一次算完回傳；app 以歷史指紋 (HistoryIndex.version) 快取，沒有新記錄的 rerun 不重算
+LEVEL_MINUTES = 120
+LEVEL_NOTE = "1/16"  # 等級只算快嘴 (與主頁的 CHOPPER LEVEL 相同)，不隨分頁的音符篩選
+ROLLING_DAYS = 30
+PACE_DAYS = 28
+PLATEAU_DAYS = 21
+SPS_PERCENTILES = (50, 75, 90, 95, 99)
+
+
+def _daily(df):
+    # 回傳 (有練習的日期 datetime64[D], 當天最佳 BPM, 當天分鐘)
+    days = df['Date'].to_numpy().astype('datetime64[D]')
+    unique_days, inverse = np.unique(days, return_inverse=True)
+    best = np.full(len(unique_days), -np.inf)
+    np.maximum.at(best, inverse, df['BPM'].to_numpy(dtype=np.float64))
+    minutes = np.bincount(inverse, weights=df['Duration'].to_numpy(dtype=np.float64), minlength=len(unique_days))
+    return unique_days, best, minutes
+
+
+def progression(days, best, window_days=ROLLING_DAYS):
+    # 每個練習日：當天最佳、近 window_days 天最佳、個人紀錄
+    index = pd.DatetimeIndex(days, name="日期")
+    # 時間視窗 (不是筆數視窗)：沒練習的日子不佔位置
+    rolling = pd.Series(best, index=index).rolling(f"{window_days}D").max().to_numpy()
+    return pd.DataFrame({'day_best': best, 'rolling_best': rolling, 'personal_best': np.maximum.accumulate(best)},
+                        index=index)
+
+
+def level_projection(days, minutes, today, level_minutes=LEVEL_MINUTES, pace_days=PACE_DAYS):
+    # 最近 pace_days 天的平均每日分鐘推估升級日；最近沒練就沒有預估
+    total = float(minutes.sum())
+    level = int(total // level_minutes)
+    to_next = level_minutes - (total - level * level_minutes)
+    recent = minutes[days > today - np.timedelta64(pace_days, 'D')].sum()
+    pace = float(recent) / pace_days
+    eta_days = int(np.ceil(to_next / pace)) if pace > 0 else None
+    return {
+        "total_minutes": total,
+        "level": level,
+        "minutes_to_next": to_next,
+        "pace_per_day": pace,
+        "eta_days": eta_days,
+        "eta_date": (today + np.timedelta64(eta_days, 'D')).astype(object) if eta_days is not None else None,
+    }
+
+
+def plateaus(days, best, today, min_days=PLATEAU_DAYS):
+    # 兩次刷新個人紀錄之間 (或最後一次刷新到今天) 超過 min_days 天就算停滯；回傳每段的起訖、練習天數與當時紀錄
+    columns = ['start', 'end', 'days', 'practice_days', 'best_bpm', 'current']
+    if len(days) == 0:
+        return pd.DataFrame(columns=columns)
+    personal = np.maximum.accumulate(best)
+    is_record = np.r_[True, personal[1:] > personal[:-1]]
+    record_idx = np.flatnonzero(is_record)
+    starts = days[record_idx]
+    ends = np.r_[days[record_idx[1:]], today]
+    lengths = (ends - starts).astype(np.int64)
+    practice = np.diff(np.r_[record_idx, len(days)]) - 1  # 兩次刷新之間 (不含刷新當天) 的練習天數
+    out = pd.DataFrame({
+        'start': starts, 'end': ends, 'days': lengths, 'practice_days': practice,
+        'best_bpm': personal[record_idx], 'current': np.arange(len(record_idx)) == len(record_idx) - 1,
+    })
+    return out[(out['days'] >= min_days) & (out['practice_days'] > 0)].reset_index(drop=True)
+
+
+def sps_percentiles(sps, percentiles=SPS_PERCENTILES):
+    if len(sps) == 0:
+        return {}
+    values = np.percentile(np.asarray(sps, dtype=np.float64), percentiles)
+    return {f"p{p}": float(v) for p, v in zip(percentiles, values)}
+
+
+@telemetry.timed("analytics.summary")
+def summary(df, note=None, today=None):
+    # note 為 None 表示全部音符；today 預設今天 (決定升級預估與目前是否停滯)
+    today = np.datetime64(today or pd.Timestamp.now().date(), 'D')
+    chopper = df[notes.mask(df['Note_Type'], LEVEL_NOTE)]
+    df = df[notes.mask(df['Note_Type'], note)] if note is not None else df
+    if df.empty:
+        return None
+    days, best, _ = _daily(df)
+    level_days, _, level_minutes = _daily(chopper)
+    return {
+        "progression": progression(days, best),
+        "level": level_projection(level_days, level_minutes, today),
+        "plateaus": plateaus(days, best, today),
+        "sps": sps_percentiles(df['SPS'].to_numpy()),
+    }
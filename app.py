@@ -1,28 +1,33 @@
+import time
+_script_start = time.perf_counter()  # 首次繪製量測：從腳本第一行到頁面內容送完
 import streamlit as st
-import pandas as pd
-import numpy as np
-import io
 import os
-import time
-import calendar
+import html
+import logging
+import importlib.util
+import uuid
 from datetime import datetime
 import streamlit.components.v1 as components
-
-# 嘗試引入 Github
-try:
-    from github import Github
-    has_github = True
-except ImportError:
-    has_github = False
+from metronome import metronome_html
+import programs
+from settings import DEFAULT_SETTINGS, FileSettings, settings_path
+from tracker import HEARTBEAT_SECONDS, SessionTracker, tracker_path
+from users import UserDirectory
+import notes
+import telemetry
+# pandas / numpy / storage / sync / heatmap / trends / transfer 都在用到的頁面或方法裡才載入，
+# 節拍器頁冷啟動不必付這些成本 (python bench.py 會量各頁的首次繪製時間)
+
+# 只檢查有沒有裝 PyGithub，真的連線時才載入
+has_github = importlib.util.find_spec("github") is not None
 
 # --- 1. 頁面全域設定 ---
 st.set_page_config(page_title="Rap Trainer Pro", page_icon="🎤", layout="centered")
 
 # --- 2. 2025 Apple Design System (CSS) ---
-st.markdown("""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
-    
+# 共用樣式每頁都注入；進度條、節拍器的樣式只在用到的頁面注入 (月曆/熱度圖的樣式在元件的 iframe 裡)
+# (字型用的是系統字，拿掉沒用到的 Google Fonts @import，首次繪製不必等外部 CSS)
+CSS_BASE = """
     html, body, [class*="css"] {
         font-family: -apple-system, BlinkMacSystemFont, "SF Pro Text", "Segoe UI", Roboto, Helvetica, Arial, sans-serif !important;
         background-color: #000000 !important;
@@ -68,47 +73,25 @@ st.markdown("""
     .ios-body { font-size: 17px; color: #FFFFFF; line-height: 1.4; }
     .ios-caption { font-size: 13px; color: #8E8E93; }
 
-    /* Calendar Styling */
-    .calendar-table {
-        width: 100%;
-        border-collapse: collapse;
-        color: white;
-        margin-top: 10px;
-    }
-    .calendar-table th {
-        color: #8E8E93;
-        font-size: 12px;
-        padding-bottom: 10px;
-        text-transform: uppercase;
-    }
-    .calendar-table td {
-        text-align: center;
-        padding: 8px 0;
-        height: 40px;
-        width: 14.28%;
-    }
-    .day-num {
-        display: inline-flex;
-        justify-content: center;
-        align-items: center;
-        width: 32px;
-        height: 32px;
-        border-radius: 50%;
-        font-size: 14px;
+    /* Buttons */
+    div.stButton > button {
+        background-color: #1C1C1E;
+        color: #FFFFFF;
+        border: none;
+        border-radius: 14px;
         font-weight: 600;
+        font-size: 17px;
+        padding: 12px 0;
+        height: auto;
+        transition: all 0.2s;
     }
-    .day-active {
-        background-color: #32D74B;
-        color: black;
-        box-shadow: 0 0 10px rgba(50, 215, 75, 0.4);
-    }
-    .day-today {
-        border: 2px solid white;
-    }
-    .day-empty {
-        color: #333;
-    }
+    div.stButton > button:hover { background-color: #2C2C2E; border: 1px solid #444; }
+    button[kind="primary"] { background-color: #32D74B !important; color: #000000 !important; }
+    button[kind="primary"]:hover { opacity: 0.9; }
+"""
 
+CSS_PAGES = {
+    "home": """
     /* Progress Bar */
     .progress-container {
         background: #2C2C2E;
@@ -125,7 +108,8 @@ st.markdown("""
         border-radius: 4px;
         transition: width 0.5s ease;
     }
-
+""",
+    "metronome": """
     /* Metronome UI */
     .bpm-big {
         font-size: 96px;
@@ -157,161 +141,366 @@ st.markdown("""
         font-weight: bold;
         font-size: 20px;
     }
+""",
+}
 
-    /* Buttons */
-    div.stButton > button {
-        background-color: #1C1C1E;
-        color: #FFFFFF;
-        border: none;
-        border-radius: 14px;
-        font-weight: 600;
-        font-size: 17px;
-        padding: 12px 0;
-        height: auto;
-        transition: all 0.2s;
-    }
-    div.stButton > button:hover { background-color: #2C2C2E; border: 1px solid #444; }
-    button[kind="primary"] { background-color: #32D74B !important; color: #000000 !important; }
-    button[kind="primary"]:hover { opacity: 0.9; }
-    </style>
-    """, unsafe_allow_html=True)
+# 診斷頁不在導覽列上：網址加 ?page=diagnostics，或 ?debug=1 時從頁尾進入
+if 'page' not in st.session_state:
+    st.session_state.page = "diagnostics" if st.query_params.get("page") == "diagnostics" else "home"
+# 計時預設關閉 (RAP_TELEMETRY=1 或 ?debug=1 才開)，開了之後這次 rerun 的各段時間都記下來
+# ?debug=1 / 診斷頁只開這次 rerun，每次 rerun 重新決定
+telemetry.begin_rerun(st.query_params.get("debug") == "1" or st.session_state.page == "diagnostics")
+st.markdown(f"<style>{CSS_BASE}{CSS_PAGES.get(st.session_state.page, '')}</style>", unsafe_allow_html=True)
 
 # --- 3. 核心邏輯層 ---
-class RapTrainerApp:
-    def __init__(self):
-        self.data_file = "rap_log_v8.csv"
-        self.note_multipliers = {"1/4": 1, "1/8": 2, "1/3": 3, "1/16": 4}
-        
-        # GitHub 初始化
-        self.gh_client = None
-        if has_github and "github" in st.secrets:
-            try:
-                self.gh_client = Github(st.secrets["github"]["token"])
-                self.repo_name = st.secrets["github"]["repo_name"]
-                self.branch = st.secrets["github"]["branch"]
-            except:
-                pass
-        self.load_data()
+logger = logging.getLogger("rap_trainer")
+
+# 歷史快取與 GitHub 同步引擎跨 rerun 共用，不必每次重讀
+# 記錄檔的副檔名決定後端：.csv / .arrow 是檔案快照 + 日誌，.db 是 SQLite (多個程序共用)
+@st.cache_resource
+def get_history_cache(data_file, columns=None):
+    from storage import COLUMNS, HistoryCache, SessionLog
+    if data_file.endswith(".db"):
+        from sqlite_store import SqliteHistoryCache, SqliteLog
+        return SqliteHistoryCache(SqliteLog(data_file), columns or COLUMNS)
+    return HistoryCache(SessionLog(data_file), columns or COLUMNS)
+
+@st.cache_resource
+def get_user_directory():
+    return UserDirectory()
+
+# 練習計時日誌：同一個檔案在整個程序只開一次，各 session 共用記憶體中的未結案練習
+@st.cache_resource
+def get_session_tracker(path):
+    return SessionTracker(path)
+
+@st.cache_resource
+def get_github_sync(token, repo_name, branch, data_file, local_repo=None, remote_prefix=None):
+    from sync import GithubSync, LocalRepo
+    # local_repo：用本地資料夾模擬 GitHub，開發/測試用
+    if local_repo:
+        factory = lambda: LocalRepo(local_repo)
+    else:
+        def factory():
+            from github import Github
+            return Github(token).get_repo(repo_name)
+    base, _ = os.path.splitext(data_file)
+    # 每位使用者在 repo 裡也有自己的資料夾；沒指定使用者時沿用根目錄 (舊版路徑)
+    if remote_prefix:
+        path, shard_dir = f"{remote_prefix}/{os.path.basename(data_file)}", f"{remote_prefix}/history"
+    else:
+        path, shard_dir = data_file, "history"
+    sync = GithubSync(factory, path, branch, f"{base}.sync.jsonl", shard_dir=shard_dir)
+    sync.start()  # 補傳上次還沒送出的記錄
+    return sync
+
+# 本地與 GitHub 的背景對帳，掛在同步執行緒上 (每輪上傳完跑一次)
+@st.cache_resource
+def get_reconciler(store_file, _sync):
+    from reconcile import Reconciler
+    reconciler = Reconciler(get_history_cache(store_file), _sync)
+    _sync.reconciler = reconciler
+    return reconciler
+
+# 趨勢圖分桶結果跨 rerun 快取；歷史沒變 (同一份檔案、同一個索引指紋) 就不重算
+@st.cache_data(max_entries=32)
+def get_trend_buckets(_df, store_file, version, note):
+    import trends
+    return trends.bucket_stats(_df, note)
+
+# 月曆/熱度圖用的每日分鐘數：整段歷史算一次，各檢視只切片
+@st.cache_data(max_entries=32)
+def get_daily_minutes(_df, store_file, version, today):
+    import heatmap
+    first = heatmap.to_days(_df['Date']).min()
+    return first, heatmap.daily_minutes(_df['Date'], _df['Duration'], first, today)
+
+# 進度分析 (個人紀錄曲線、升級預估、停滯期、SPS 百分位) 也以歷史指紋快取；日期換了才重算預估
+@st.cache_data(max_entries=32)
+def get_practice_analytics(_df, store_file, version, note, today):
+    import analytics
+    return analytics.summary(_df, note, today)
+
+# 主頁只需要這幾欄，Arrow 快照下其他欄位不會被讀進來
+DASHBOARD_COLUMNS = ('Date', 'BPM', 'Note_Type', 'Duration')
+# 儲存後端：files (預設，單一程序) 或 sqlite (同一台機器上多個程序共用記錄、設定)
+# 以環境變數 RAP_STORAGE=sqlite 切換；每個 worker 程序都要設同一個值
+STORAGE_BACKEND = os.environ.get("RAP_STORAGE", "files")
 
-    def load_data(self):
-        # 1. 嘗試從 GitHub
-        data_loaded = False
-        if self.gh_client:
-            try:
-                repo = self.gh_client.get_repo(self.repo_name)
-                contents = repo.get_contents(self.data_file, ref=self.branch)
-                decoded = contents.decoded_content.decode("utf-8")
-                self.history = pd.read_csv(io.StringIO(decoded))
-                data_loaded = True
-            except:
-                pass
-        
-        # 2. 嘗試從本地
-        if not data_loaded:
-            if os.path.exists(self.data_file):
-                try:
-                    self.history = pd.read_csv(self.data_file)
-                except:
-                    self.init_empty_db()
-            else:
-                self.init_empty_db()
-
-        # 3. 資料清洗
-        if not self.history.empty:
-            if 'Date' in self.history.columns:
-                self.history['Date'] = pd.to_datetime(self.history['Date'], errors='coerce')
-                self.history = self.history.dropna(subset=['Date'])
-            for col in ['Duration', 'BPM', 'SPS']:
-                if col in self.history.columns:
-                    self.history[col] = pd.to_numeric(self.history[col], errors='coerce').fillna(0)
-        
-        if 'history' not in st.session_state:
-            st.session_state.history = self.history
-        
-        # 啟動時讀取上次 BPM
-        if 'bpm_initialized' not in st.session_state:
-            if not self.history.empty:
+class RapTrainerApp:
+    # columns 為 None 表示全部欄位；歷史、索引、GitHub 同步都在第一次用到時才載入/建立
+    def __init__(self, columns=None, user=None):
+        # 有指定使用者就用 users/<分區>/ 底下的檔案，快取與鎖都跟著檔案路徑分開
+        self.user = user or None
+        folder = get_user_directory().folder(self.user) if self.user else ""
+        self.remote_prefix = get_user_directory().remote_prefix(self.user) if self.user else None
+        self.data_file = os.path.join(folder, "rap_log_v8.csv")
+        self.settings_file = settings_path(self.data_file)
+        if STORAGE_BACKEND == "sqlite":
+            # 第一次開啟時把既有的檔案記錄搬進資料庫；沒存過設定前沿用 JSON 設定檔
+            from sqlite_store import SqliteSettings
+            self.store_file = os.path.join(folder, "rap_log_v8.db")
+            self.settings = SqliteSettings(self.store_file, legacy=FileSettings(self.settings_file))
+        else:
+            # 跑過 python storage.py 搬移後改用 Arrow 欄式快照
+            arrow_file = os.path.join(folder, "rap_log_v8.arrow")
+            self.store_file = arrow_file if os.path.exists(arrow_file) else self.data_file
+            self.settings = FileSettings(self.settings_file)
+        self.tracker_file = tracker_path(self.data_file)
+        self.timing_file = os.path.join(folder, "rap_log_v8.timing.csv")
+        self.columns = columns
+        self.note_multipliers = notes.NOTE_MULTIPLIERS
+        self._cache = None
+        self._history = None
+        self._index = None
+        self._sync = None
+        self._sync_ready = False
+        self.init_settings()
+
+    # --- 延後載入 ---
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = get_history_cache(self.store_file, self.columns)
+        return self._cache
+
+    @property
+    def log(self):
+        return self.cache.log
+
+    @property
+    def history(self):
+        if self._history is None:
+            self.load_data()
+        return self._history
+
+    @property
+    def index(self):
+        if self._index is None:
+            self.load_data()
+        return self._index
+
+    @property
+    def sync(self):
+        # GitHub 初始化 (會載入 pandas / PyGithub)，第一次用到才做
+        if not self._sync_ready:
+            self._sync_ready = True
+            if "github" in st.secrets:
+                cfg = st.secrets["github"]
                 try:
-                    last_bpm = int(self.history.iloc[-1]['BPM'])
-                    st.session_state.bpm = last_bpm
-                except:
-                    st.session_state.bpm = 85
-            else:
-                st.session_state.bpm = 85
-            st.session_state.bpm_initialized = True
-
-    def init_empty_db(self):
-        self.history = pd.DataFrame(columns=['Date', 'BPM', 'Note_Type', 'SPS', 'Duration', 'Focus'])
-
-    def save_data(self, df):
-        df.to_csv(self.data_file, index=False)
-        st.session_state.history = df
-        if self.gh_client:
+                    if "local_repo" in cfg:
+                        self._sync = get_github_sync(None, None, cfg.get("branch"), self.data_file, cfg["local_repo"],
+                                                     self.remote_prefix)
+                    elif has_github:
+                        self._sync = get_github_sync(cfg["token"], cfg["repo_name"], cfg["branch"], self.data_file,
+                                                     remote_prefix=self.remote_prefix)
+                except KeyError as e:
+                    logger.error("GitHub secrets incomplete: missing %s", e)
+        return self._sync
+
+    @property
+    def reconciler(self):
+        return get_reconciler(self.store_file, self.sync) if self.sync else None
+
+    def start_sync(self):
+        if self.reconciler:
+            self.sync.start()
+
+    def init_settings(self):
+        # 啟動時讀取上次設定 (BPM / 音符 / Ghost)；舊版沒有設定檔時才從歷史最後一筆取 BPM
+        if 'last_settings' not in st.session_state:
+            settings = self.settings.load()
+            if settings is None:
+                settings = {**DEFAULT_SETTINGS, "bpm": self.last_bpm()}
+            st.session_state.bpm = int(settings["bpm"])
+            st.session_state.last_settings = settings
+
+    def last_bpm(self):
+        if self.history.empty:
+            return DEFAULT_SETTINGS["bpm"]
+        try:
+            return int(self.history.iloc[-1]['BPM'])
+        except (KeyError, ValueError, TypeError):
+            return DEFAULT_SETTINGS["bpm"]
+
+    @property
+    def tracker(self):
+        return get_session_tracker(self.tracker_file)
+
+    def remember_settings(self, bpm, note, ghost):
+        st.session_state.last_settings = self.settings.save(bpm=int(bpm), note=note, ghost=bool(ghost))
+
+    @telemetry.timed("app.load_data")
+    def load_data(self):
+        # 1. 一律從本地讀 (快照 + 追加日誌，沒有 v8 時讀 v5/v3；只解析新增的行)，GitHub 在背景對帳
+        self._history = self.cache.load()
+        self._index = self.cache.index
+
+        # 2. 新裝置第一次開啟 (本地完全沒有記錄)：先同步對帳一次，把 GitHub 上的歷史拉下來
+        if self._history.empty and self.reconciler:
+            from sync import GithubException
             try:
-                repo = self.gh_client.get_repo(self.repo_name)
-                csv_content = df.to_csv(index=False)
-                try:
-                    contents = repo.get_contents(self.data_file, ref=self.branch)
-                    repo.update_file(contents.path, f"Auto-save {datetime.now()}", csv_content, contents.sha, branch=self.branch)
-                except:
-                    repo.create_file(self.data_file, "Init data", csv_content, branch=self.branch)
-                return True
-            except:
-                pass
-        return False
+                self.reconciler.run_once()
+                self._history = self.cache.load()
+                self._index = self.cache.index
+            except (GithubException, OSError, ValueError) as e:
+                logger.warning("GitHub bootstrap failed, starting empty: %s", e)
+
+        # 3. 資料清洗已在快取載入時完成，未變動時是同一個 DataFrame
+        st.session_state.history = self._history
+
+    @telemetry.timed("app.append_session")
+    def append_session(self, entry):
+        # 一般存檔：本地只追加一行，GitHub 交給背景同步批次上傳；歷史等下次用到時再增量載入
+        self.log.append(entry)
+        if self.sync:
+            self.sync.enqueue(entry)
+        self._history = self._index = None
+
+    @telemetry.timed("app.append_sessions")
+    def append_sessions(self, entries):
+        # 訓練計畫：完成的各階一次寫入 (本地一次持鎖追加、GitHub 佇列一次排入)
+        import pandas as pd
+        self.log.append_frame(pd.DataFrame(entries))
+        if self.sync:
+            self.sync.enqueue_many(entries)
+        self._history = self._index = None
+
+    def start_program(self, name):
+        # 同一個計畫每天接著數；換了計畫或上一輪已經走完 (超過天數) 才從今天重新開始
+        settings = st.session_state.last_settings
+        if (settings.get("program") != name or not settings.get("program_started")
+                or programs.program_day(settings["program_started"], programs.PROGRAMS[name]["days"]) is None):
+            st.session_state.last_settings = self.settings.save(program=name,
+                                                                program_started=datetime.now().date().isoformat())
+
+    @telemetry.timed("app.import_files")
+    def import_files(self, files):
+        # 外部 CSV 分塊匯入本地日誌；GitHub 不在這條路徑上：喚醒背景同步，由對帳把遠端沒有的記錄排進上傳佇列
+        from transfer import import_csv
+        summary = import_csv(self.log, files)
+        if summary["imported"] and self.reconciler:
+            self.sync.wake()
+        self._history = self._index = None
+        return summary
+
+    @telemetry.timed("app.analyze_recording")
+    def analyze_recording(self, session, upload):
+        # 上傳的 WAV 先寫成暫存檔，分段讀取 (長錄音交給子程序) 時不必整份放在記憶體
+        import tempfile
+        import rhythm
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+            for block in iter(lambda: upload.read(1 << 20), b""):
+                tmp.write(block)
+        try:
+            result = rhythm.analyze(tmp.name, session['BPM'], session['Note_Type'])
+        finally:
+            os.unlink(tmp.name)
+        return rhythm.save_result(self.timing_file, session, result)
+
+    def timing_results(self):
+        import rhythm
+        return rhythm.load_results(self.timing_file)
 
     def calculate_sps(self, bpm, note_label):
-        for k, v in self.note_multipliers.items():
-            if k in note_label: return (bpm * v) / 60
-        return bpm / 60
-
-    def get_total_minutes(self):
-        if st.session_state.history.empty: return 0
-        return st.session_state.history['Duration'].sum()
+        return (bpm * notes.multiplier(note_label)) / 60
 
+    # 查摘要索引，不再掃描整份歷史
     def get_chopper_minutes(self):
-        if st.session_state.history.empty: return 0
-        df = st.session_state.history
-        chopper_df = df[df['Note_Type'].str.contains("1/16", na=False)]
-        return chopper_df['Duration'].sum()
+        return self.index.minutes("1/16")
 
-app = RapTrainerApp()
+# 網址加 ?user=名字 切換訓練者；不加則使用共用的舊版記錄
+if 'user' not in st.session_state: st.session_state.user = st.query_params.get("user", "").strip()
+app = RapTrainerApp(DASHBOARD_COLUMNS if st.session_state.page == "home" else None, st.session_state.user)
 
 # --- 4. 狀態管理 ---
 if 'bpm' not in st.session_state: st.session_state.bpm = 85
 if 'playing' not in st.session_state: st.session_state.playing = False
-if 'page' not in st.session_state: st.session_state.page = "home"
-if 'start_time' not in st.session_state: st.session_state.start_time = None 
+if 'session_id' not in st.session_state: st.session_state.session_id = None
+
+# 分頁識別碼放在網址 (?client=)：重新整理或斷線重連後還是同一個分頁，其他分頁 / 訓練者各有自己的
+if 'client_id' not in st.session_state:
+    st.session_state.client_id = st.query_params.get("client") or uuid.uuid4().hex[:12]
+    st.query_params["client"] = st.session_state.client_id
+
+# 新的 session (重新整理、斷線重連、伺服器重啟)：從練習日誌接回這個分頁進行中或還沒存檔的練習
+if 'sessions_recovered' not in st.session_state:
+    st.session_state.sessions_recovered = True
+    running, pending = app.tracker.recover(st.session_state.client_id)
+    if running:
+        st.session_state.session_id = running[-1]
+        st.session_state.playing = True
+    elif pending:
+        st.session_state.session_id = pending[-1]
 
 def update_bpm_from_slider(): st.session_state.bpm = st.session_state.bpm_slider
 def update_bpm_from_number(): st.session_state.bpm = st.session_state.bpm_number
 
-def toggle_play():
+def toggle_play(bpm, note, ghost, program=None):
+    # 開始/停止都寫進練習日誌；時長之後從日誌算
+    # 計畫：整份階梯記在日誌裡，斷線重連或存檔時都照開始當時的階梯算
     st.session_state.playing = not st.session_state.playing
-    if st.session_state.playing:
-        st.session_state.start_time = time.time()
+    if st.session_state.playing and program:
+        steps = programs.compile_program(programs.PROGRAMS[program])
+        st.session_state.session_id = app.tracker.start(st.session_state.client_id, bpm=bpm, note=note, ghost=ghost,
+                                                        program=program, steps=steps)
+    elif st.session_state.playing:
+        st.session_state.session_id = app.tracker.start(st.session_state.client_id, bpm=bpm, note=note, ghost=ghost)
     else:
-        pass
+        # 計畫的 BPM / 音符以階梯為準，不蓋掉開始時記的值
+        session = app.tracker.get(st.session_state.session_id)
+        info = {} if session and session["info"].get("steps") else {"bpm": bpm, "note": note}
+        app.tracker.stop(st.session_state.session_id, **info)
+
+# 練習中每 HEARTBEAT_SECONDS 秒只重跑這一小段：寫心跳並更新已練習時間，節拍器本身不會重繪
+@st.fragment(run_every=HEARTBEAT_SECONDS)
+def practice_heartbeat(session_id):
+    app.tracker.heartbeat(session_id)
+    elapsed = app.tracker.elapsed(session_id) or 0
+    session = app.tracker.get(session_id)
+    steps = session["info"].get("steps") if session else None
+    progress = ""
+    if steps:
+        step = programs.current_step(steps, elapsed)
+        if step is None:
+            # 整份計畫播完 (引擎已自己停)：以最後一階結束的時間收尾，顯示存檔卡片
+            app.tracker.stop(session_id, at=session["start"] + programs.total_seconds(steps))
+            st.session_state.playing = False
+            st.rerun()
+        progress = f" · 第 {step + 1}/{len(steps)} 階 {steps[step][0]} BPM"
+    st.markdown(f'<div class="bpm-label">已練習 {int(elapsed // 60)}:{int(elapsed % 60):02d}{progress}</div>',
+                unsafe_allow_html=True)
 
 def nav_to(page_name):
     st.session_state.page = page_name
 
 # --- 5. 介面導航 ---
+# 用 on_click 切頁：callback 在腳本執行前就跑完，建立 app 時已知道要顯示哪一頁
 nav1, nav2, nav3 = st.columns(3)
 with nav1:
-    if st.button("🏠 主頁", use_container_width=True): nav_to("home")
+    st.button("🏠 主頁", use_container_width=True, on_click=nav_to, args=("home",))
 with nav2:
-    if st.button("⏱️ 節拍", use_container_width=True): nav_to("metronome")
+    st.button("⏱️ 節拍", use_container_width=True, on_click=nav_to, args=("metronome",))
 with nav3:
-    if st.button("📊 數據", use_container_width=True): nav_to("stats")
+    st.button("📊 數據", use_container_width=True, on_click=nav_to, args=("stats",))
 
 st.markdown("---")
+_page_start = time.perf_counter()
+
+# 節拍器引擎在 window.parent，切到其他頁也繼續播放：心跳不能只在節拍器頁寫，
+# 否則超過 STALE_SECONDS 後重新連線 (或別的 session 的 recover) 會把還在練的這段收尾
+# 節拍器頁把心跳放在播放鍵下面，其他頁放在最上面
+if st.session_state.playing and st.session_state.session_id and st.session_state.page != "metronome":
+    practice_heartbeat(st.session_state.session_id)
 
 # ================= 🏠 主頁 (Dashboard) =================
 if st.session_state.page == "home":
+    import numpy as np
+    import heatmap
     st.markdown('<div class="ios-headline">總覽</div>', unsafe_allow_html=True)
+    if app.user:
+        st.markdown(f'<div class="ios-caption">訓練者：{html.escape(app.user)}</div>', unsafe_allow_html=True)
     
-    df = st.session_state.history
     chopper_mins = app.get_chopper_minutes()
     
     level = int(chopper_mins // 120)
@@ -340,19 +529,16 @@ if st.session_state.page == "home":
 
     # Stats Summary
     c1, c2 = st.columns(2)
-    days_streak = df['Date'].dt.date.nunique() if not df.empty else 0
-    max_chopper_bpm = 0
-    if not df.empty:
-        chopper_df = df[df['Note_Type'].str.contains("1/16", na=False)]
-        if not chopper_df.empty:
-            max_chopper_bpm = chopper_df['BPM'].max()
+    train_days = np.array(sorted(app.index.days), dtype='datetime64[D]')
+    days_streak, longest_streak = heatmap.streaks(train_days, datetime.now().date())
+    max_chopper_bpm = app.index.max_bpm("1/16")
     
     with c1:
         st.markdown(f"""
         <div class="glass-card" style="text-align:center; padding:16px;">
             <div class="ios-subhead">連續打卡</div>
             <div style="font-size: 32px; font-weight: 700; color: white;">{days_streak}</div>
-            <div class="ios-caption">天</div>
+            <div class="ios-caption">天 · 最長 {longest_streak} 天</div>
         </div>
         """, unsafe_allow_html=True)
     
@@ -367,215 +553,222 @@ if st.session_state.page == "home":
 
 # ================= ⏱️ 節拍器 (Metronome) =================
 elif st.session_state.page == "metronome":
-    
-    col_note, col_ghost = st.columns([2, 1])
-    with col_note:
-        note_display = {"1/4": "♩ Quarter", "1/8": "♫ Eighth", "1/3": "3 Triplet", "1/16": ":::: Sixteenth"}
-        selected_note_key = st.selectbox("Note", list(app.note_multipliers.keys()), 
-                                       index=3, label_visibility="collapsed", 
-                                       format_func=lambda x: note_display.get(x, x))
-    with col_ghost:
-        ghost_mode = st.toggle("Ghost")
+    # 預設值來自上次設定檔，不必載入歷史
+    last_settings = st.session_state.last_settings
+
+    # 訓練計畫：選了計畫就由預先展開的階梯決定 BPM / 音符 / Ghost，播放中不能換
+    running = app.tracker.get(st.session_state.session_id) if st.session_state.playing and st.session_state.session_id else None
+    program_names = ["自由練習"] + list(programs.PROGRAMS)
+    default_program = running["info"].get("program") if running else last_settings.get("program")
+    program = st.selectbox("訓練計畫", program_names,
+                           index=program_names.index(default_program) if default_program in program_names else 0,
+                           disabled=st.session_state.playing, label_visibility="collapsed")
+    program = None if program == "自由練習" else program
+
+    if program:
+        spec = programs.PROGRAMS[program]
+        selected_note_key, ghost_mode = spec["note"], spec["ghost"]
+        current_bpm = spec["start"]
+        day_label = "今天開始"
+        if last_settings.get("program") == program and last_settings.get("program_started"):
+            day = programs.program_day(last_settings["program_started"], spec["days"])
+            day_label = f"第 {day} / {spec['days']} 天" if day else f"{spec['days']} 天已完成 · 開始後重新計算"
+        st.markdown(f"""
+        <div class="glass-card">
+            <div class="ios-subhead">{html.escape(program)}</div>
+            <div class="ios-body">{spec['note']}{' · Ghost' if spec['ghost'] else ''} · {programs.describe(spec)}</div>
+            <div class="ios-caption">{day_label}</div>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        col_note, col_ghost = st.columns([2, 1])
+        with col_note:
+            note_display = {"1/4": "♩ Quarter", "1/8": "♫ Eighth", "1/3": "3 Triplet", "1/16": ":::: Sixteenth"}
+            note_keys = list(app.note_multipliers.keys())
+            selected_note_key = st.selectbox("Note", note_keys, 
+                                           index=note_keys.index(last_settings["note"]) if last_settings["note"] in note_keys else 3,
+                                           label_visibility="collapsed", 
+                                           format_func=lambda x: note_display.get(x, x))
+        with col_ghost:
+            ghost_mode = st.toggle("Ghost", value=bool(last_settings["ghost"]))
 
-    st.markdown("<br>", unsafe_allow_html=True)
+        st.markdown("<br>", unsafe_allow_html=True)
 
-    current_bpm = st.session_state.bpm
-    sps = app.calculate_sps(current_bpm, selected_note_key)
-    
-    st.markdown(f'<div class="bpm-big">{current_bpm}</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="bpm-label">{sps:.1f} 音節 / 秒</div>', unsafe_allow_html=True)
+        current_bpm = st.session_state.bpm
+        sps = app.calculate_sps(current_bpm, selected_note_key)
+        
+        st.markdown(f'<div class="bpm-big">{current_bpm}</div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="bpm-label">{sps:.1f} 音節 / 秒</div>', unsafe_allow_html=True)
 
-    st.slider("BPM Slider", 50, 200, key="bpm_slider", value=st.session_state.bpm, on_change=update_bpm_from_slider, label_visibility="collapsed")
-    
-    c_spacer1, c_input, c_spacer2 = st.columns([1, 2, 1])
-    with c_input:
-        st.number_input("BPM Input", 50, 200, key="bpm_number", value=st.session_state.bpm, on_change=update_bpm_from_number, label_visibility="collapsed")
+        st.slider("BPM Slider", 50, 200, key="bpm_slider", value=st.session_state.bpm, on_change=update_bpm_from_slider, label_visibility="collapsed")
+        
+        c_spacer1, c_input, c_spacer2 = st.columns([1, 2, 1])
+        with c_input:
+            st.number_input("BPM Input", 50, 200, key="bpm_number", value=st.session_state.bpm, on_change=update_bpm_from_number, label_visibility="collapsed")
 
     st.markdown("<br>", unsafe_allow_html=True)
 
     btn_label = "⏹ 停止訓練" if st.session_state.playing else "▶ 開始訓練"
     if st.button(btn_label, type="primary", use_container_width=True):
-        toggle_play()
+        toggle_play(current_bpm, selected_note_key, ghost_mode, program)
+        if st.session_state.playing and program:
+            app.start_program(program)
+        elif st.session_state.playing:
+            app.remember_settings(current_bpm, selected_note_key, ghost_mode)
         st.rerun()
 
-    # 自動保存
-    if not st.session_state.playing and st.session_state.start_time:
-        elapsed = time.time() - st.session_state.start_time
+    if st.session_state.playing and st.session_state.session_id:
+        practice_heartbeat(st.session_state.session_id)
+
+    # 自動保存：時長 = 日誌裡的開始到停止 (斷線/重啟後接回的練習以最後一次心跳為止)
+    session_id = st.session_state.session_id
+    session = app.tracker.get(session_id) if session_id and not st.session_state.playing else None
+    if session_id and not st.session_state.playing and session is None:
+        st.session_state.session_id = None  # 已在其他分頁存檔或放棄
+    if session and session["stopped"] is not None:
+        elapsed = session["stopped"] - session["start"]
         elapsed_mins = elapsed / 60
+        # 計畫：每個完整播完的階各一筆記錄，存檔時一次寫入
+        info = session["info"]
+        steps = info.get("steps")
+        entries = programs.step_entries(steps, info.get("note"), session["start"], elapsed,
+                                        f"Program: {info.get('program')}") if steps else None
         
-        if elapsed < 10:
-            st.info("練習時間太短，未記錄。")
-            st.session_state.start_time = None
+        if elapsed < 10 or (steps and not entries):
+            st.info("練習時間太短，未記錄。" if not steps else "計畫還沒完成任何一階，未記錄。")
+            app.tracker.resolve(session_id, "discarded")
+            st.session_state.session_id = None
         else:
+            recovered_note = '<div class="ios-caption">由中斷的練習接回</div>' if session.get("recovered") else ""
+            steps_note = (f'<div class="ios-body">完成 <b>{len(entries)} / {len(steps)}</b> 階 · '
+                          f'{entries[0]["BPM"]}→{entries[-1]["BPM"]} BPM</div>') if steps else ""
             st.markdown(f"""
             <div class="glass-card" style="border-color:#32D74B; margin-top:20px;">
                 <div class="ios-subhead" style="color:#32D74B">訓練完成</div>
                 <div class="ios-body">本次練習時長：<b>{int(elapsed)} 秒</b> ({elapsed_mins:.1f} 分)</div>
+                {steps_note}
+                {recovered_note}
             </div>
             """, unsafe_allow_html=True)
             
             col_save, col_discard = st.columns(2)
             with col_save:
                 if st.button("✅ 存檔", use_container_width=True, type="primary"):
-                    new_entry = pd.DataFrame([{
-                        'Date': datetime.now(),
-                        'BPM': current_bpm,
-                        'Note_Type': selected_note_key,
-                        'SPS': sps,
-                        'Duration': round(elapsed_mins, 2),
-                        'Focus': "Auto-log"
-                    }])
-                    st.session_state.history = pd.concat([st.session_state.history, new_entry], ignore_index=True)
-                    app.save_data(st.session_state.history)
-                    st.session_state.start_time = None 
+                    if entries:
+                        app.append_sessions(entries)
+                    else:
+                        # BPM / 音符以停止 (或開始) 時記下的為準
+                        bpm, note = info.get("bpm", current_bpm), info.get("note", selected_note_key)
+                        app.append_session({
+                            'Date': datetime.fromtimestamp(session["stopped"]),
+                            'BPM': bpm,
+                            'Note_Type': note,
+                            'SPS': app.calculate_sps(bpm, note),
+                            'Duration': round(elapsed_mins, 2),
+                            'Focus': "Auto-log"
+                        })
+                    app.tracker.resolve(session_id, "saved")
+                    st.session_state.session_id = None
                     st.toast("記錄已保存！")
                     st.rerun()
             with col_discard:
                 if st.button("🗑️ 放棄", use_container_width=True):
-                    st.session_state.start_time = None
+                    app.tracker.resolve(session_id, "discarded")
+                    st.session_state.session_id = None
                     st.rerun()
 
-    # JS 引擎 (鼓聲)
-    js_bpm = st.session_state.bpm
-    js_playing = "true" if st.session_state.playing else "false"
+    # JS 引擎 (鼓聲)：look-ahead 排程，網址加 ?debug=1 顯示計時統計
+    # 計畫播放中：整份階梯一次送給引擎，從目前這階接著播 (同一個練習 ID 重送不會重來)
+    show_stats = st.query_params.get("debug") == "1"
     note_mult = app.note_multipliers.get(selected_note_key, 1)
-    js_interval = (60 / js_bpm) / note_mult * 1000 
-    js_ghost = "true" if ghost_mode else "false"
-    
-    components.html(f"""
-    <script>
-        window.AudioContext = window.AudioContext || window.webkitAudioContext;
-        if (!window.audioCtx) window.audioCtx = new window.AudioContext();
-        
-        var isPlaying = {js_playing};
-        var interval = {js_interval};
-        var isGhost = {js_ghost};
-        var subdivisions = {note_mult};
-        
-        if (window.metronomeTimer) {{ clearInterval(window.metronomeTimer); window.metronomeTimer = null; }}
-        if (!window.beatCount) window.beatCount = 0;
-
-        function playSound(type) {{
-            if (window.audioCtx.state === 'suspended') window.audioCtx.resume();
-            var osc = window.audioCtx.createOscillator();
-            var gainNode = window.audioCtx.createGain();
-            osc.connect(gainNode);
-            gainNode.connect(window.audioCtx.destination);
-            var now = window.audioCtx.currentTime;
-
-            if (type === 'kick') {{
-                osc.frequency.setValueAtTime(150, now);
-                osc.frequency.exponentialRampToValueAtTime(0.01, now + 0.5);
-                gainNode.gain.setValueAtTime(1, now);
-                gainNode.gain.exponentialRampToValueAtTime(0.01, now + 0.5);
-                osc.start(now); osc.stop(now + 0.5);
-            }} else if (type === 'hihat') {{
-                osc.type = 'square';
-                osc.frequency.setValueAtTime(800, now);
-                gainNode.gain.setValueAtTime(0.2, now);
-                gainNode.gain.exponentialRampToValueAtTime(0.01, now + 0.05);
-                osc.start(now); osc.stop(now + 0.05);
-            }} else {{
-                osc.type = 'triangle';
-                osc.frequency.setValueAtTime(300, now);
-                gainNode.gain.setValueAtTime(0.4, now);
-                gainNode.gain.exponentialRampToValueAtTime(0.01, now + 0.1);
-                osc.start(now); osc.stop(now + 0.1);
-            }}
-        }}
-
-        if (isPlaying) {{
-            window.metronomeTimer = setInterval(() => {{
-                var totalSubPerBar = 4 * subdivisions;
-                var currentPos = window.beatCount % totalSubPerBar;
-                var barNum = Math.floor(window.beatCount / totalSubPerBar) + 1;
-                var isGhostBar = isGhost && (barNum % 4 === 0);
-
-                if (!isGhostBar) {{
-                    if (currentPos === 0) {{ playSound('kick'); }} 
-                    else if (currentPos % subdivisions === 0) {{ playSound('snare'); }} 
-                    else {{ playSound('hihat'); }}
-                }}
-                window.beatCount++;
-            }}, interval);
-        }} else {{ window.beatCount = 0; }}
-    </script>
-    """, height=0)
+    program_payload = None
+    if running and running["info"].get("steps"):
+        steps = running["info"]["steps"]
+        step = programs.current_step(steps, app.tracker.elapsed(st.session_state.session_id))
+        program_payload = {"id": st.session_state.session_id, "steps": steps, "from": len(steps) if step is None else step}
+    components.html(metronome_html(st.session_state.bpm, note_mult, ghost_mode, st.session_state.playing, show_stats,
+                                   program_payload),
+                    height=24 if show_stats else 0)
 
 # ================= 📊 數據 (Stats) =================
 elif st.session_state.page == "stats":
+    import numpy as np
+    import analytics
+    import heatmap
+    import trends
+    from transfer import export_csv_file
     st.markdown('<div class="ios-headline">數據中心</div>', unsafe_allow_html=True)
     
-    if st.session_state.history.empty:
+    if app.history.empty:
         st.info("尚無數據，請先開始訓練")
     else:
-        df = st.session_state.history
+        df = app.history
         
-        # === 1. 月曆顯示 (新增功能) ===
+        # === 1. 月曆 / 熱度圖 ===
         now = datetime.now()
-        year, month = now.year, now.month
-        month_name = calendar.month_name[month]
-        cal = calendar.monthcalendar(year, month)
-        
-        # 篩選當月有訓練的日期
-        mask = (df['Date'].dt.year == year) & (df['Date'].dt.month == month)
-        trained_days = set(df.loc[mask, 'Date'].dt.day.tolist())
-        today = now.day
-
-        # 生成月曆 HTML
-        cal_html = f"""
-        <div class="glass-card">
-            <div class="ios-subhead">{month_name} {year}</div>
-            <table class="calendar-table">
-                <thead>
-                    <tr>
-                        <th>Mo</th><th>Tu</th><th>We</th><th>Th</th><th>Fr</th><th>Sa</th><th>Su</th>
-                    </tr>
-                </thead>
-                <tbody>
-        """
-        for week in cal:
-            cal_html += "<tr>"
-            for day in week:
-                if day == 0:
-                    cal_html += "<td></td>"
-                else:
-                    active_class = "day-active" if day in trained_days else ""
-                    today_class = "day-today" if day == today else ""
-                    color_style = "color: white;" if day in trained_days else "color: #555;"
-                    
-                    cal_html += f"""
-                    <td>
-                        <div class="day-num {active_class} {today_class}" style="{color_style}">
-                            {day}
-                        </div>
-                    </td>
-                    """
-            cal_html += "</tr>"
-        cal_html += "</tbody></table></div>"
-        
-        st.markdown(cal_html, unsafe_allow_html=True)
+        cal_view = st.radio("日曆範圍", ["本月", "今年", "全部"], horizontal=True, label_visibility="collapsed")
+        # 只送每日分鐘數 (uint16) 給瀏覽器端的元件畫；範圍再大伺服器端也只是切片與編碼
+        today = np.datetime64(now.date(), 'D')
+        first_day, all_minutes = get_daily_minutes(df, app.store_file, app.index.version(), now.date())
+        if cal_view == "本月":
+            view, start = "month", today.astype('datetime64[M]').astype('datetime64[D]')
+        elif cal_view == "今年":
+            view, start = "year", np.datetime64(f"{now.year}-01-01", 'D')
+        else:
+            view, start = "years", min(first_day, today)
+        minutes = heatmap.slice_days(first_day, all_minutes, start, today)
+        components.html(heatmap.calendar_html(view, start, minutes, today, f"{start} – {today}"),
+                        height=heatmap.calendar_height(view, start, today))
 
         # === 2. 輸出與分析 ===
-        csv = df.to_csv(index=False).encode('utf-8')
-        st.download_button("📤 輸出 CSV 記錄", csv, "rap_log.csv", "text/csv", use_container_width=True)
+        with st.expander("輸出範圍 / 匯入"):
+            c_from, c_to = st.columns(2)
+            with c_from:
+                export_start = st.date_input("開始", df['Date'].min().date(), key="export_start")
+            with c_to:
+                export_end = st.date_input("結束", now.date(), key="export_end")
+            export_notes = st.multiselect("音符類型", [n for n in notes.NOTE_LABELS if n in app.index.per_note], placeholder="全部")
+            uploads = st.file_uploader("📥 匯入 CSV (支援 v3 / v5 舊格式)", type="csv", accept_multiple_files=True)
+            if uploads and st.button("匯入", use_container_width=True):
+                summary = app.import_files(uploads)
+                st.toast(f"匯入 {summary['imported']} 筆 · 重複 {summary['duplicates']} · 無效 {summary['invalid']}")
+                st.rerun()
+        # 按下才在背景分塊寫成暫存檔，平常 rerun 不再把整份歷史轉成 CSV
+        st.download_button("📤 輸出 CSV 記錄", lambda: export_csv_file(df, export_start, export_end, export_notes),
+                           "rap_log.csv", "text/csv", use_container_width=True)
+
+        # 節奏準確度 (選用)：上傳某次練習的錄音，對照那次的 BPM x 音符找出起音並評分
+        with st.expander("🎙️ 節奏準確度 (上傳練習錄音)"):
+            recent = df.tail(20).iloc[::-1]
+            choice = st.selectbox("對應的練習", range(len(recent)), key="recording_session",
+                                  format_func=lambda i: f"{recent['Date'].iloc[i]:%Y-%m-%d %H:%M} · "
+                                                        f"{recent['Note_Type'].iloc[i]} · {int(recent['BPM'].iloc[i])} BPM")
+            recording = st.file_uploader("錄音 (WAV)", type="wav", key="recording")
+            if recording and st.button("分析節奏", use_container_width=True):
+                try:
+                    with st.spinner("分析中…"):
+                        analysed = app.analyze_recording(recent.iloc[choice], recording)
+                    st.toast(f"準確度 {analysed['Accuracy']:.0%} · 平均偏差 {analysed['Mean_Abs_Error_ms']:.0f} ms")
+                except ValueError as e:
+                    st.error(f"無法分析這個錄音：{e}")
+            timing = app.timing_results()
+            if not timing.empty:
+                timing = timing.tail(10).iloc[::-1].assign(Accuracy=lambda t: (t['Accuracy'] * 100).round(1))
+                st.dataframe(timing[['Date', 'Note_Type', 'BPM', 'Accuracy', 'Mean_Abs_Error_ms', 'Onsets', 'Expected']]
+                             .round(1).rename(columns={'Date': '日期', 'Note_Type': '音符', 'Accuracy': '準確度 %',
+                                                       'Mean_Abs_Error_ms': '平均偏差 ms', 'Onsets': '起音',
+                                                       'Expected': '應有'}),
+                             use_container_width=True, hide_index=True)
         
         st.markdown("<br>", unsafe_allow_html=True)
 
-        tab_list = ["全部", "1/16 快嘴", "1/8 基礎", "1/3 三連音"]
-        selected_tab = st.selectbox("選擇分析模式", tab_list)
-        
-        filtered_df = df.copy()
-        if selected_tab == "1/16 快嘴":
-            filtered_df = df[df['Note_Type'].str.contains("1/16", na=False)]
-        elif selected_tab == "1/8 基礎":
-            filtered_df = df[df['Note_Type'].str.contains("1/8", na=False)]
-        elif selected_tab == "1/3 三連音":
-            filtered_df = df[df['Note_Type'].str.contains("1/3", na=False)]
+        tab_notes = {"全部": None, "1/16 快嘴": "1/16", "1/8 基礎": "1/8", "1/3 三連音": "1/3"}
+        selected_tab = st.selectbox("選擇分析模式", list(tab_notes.keys()))
+        note = tab_notes[selected_tab]
         
-        if not filtered_df.empty:
-            max_val = filtered_df['BPM'].max()
-            avg_val = filtered_df['BPM'].mean()
+        if app.index.sessions(note) > 0:
+            max_val = app.index.max_bpm(note)
+            avg_val = app.index.mean_bpm(note)
             st.markdown(f"""
             <div class="glass-card">
                 <div class="ios-subhead">{selected_tab} 表現</div>
@@ -593,16 +786,95 @@ elif st.session_state.page == "stats":
             """, unsafe_allow_html=True)
             
             st.markdown('<div class="ios-subhead">BPM 成長趨勢</div>', unsafe_allow_html=True)
-            chart_data = filtered_df.sort_values('Date')
-            st.line_chart(chart_data.set_index('Date')['BPM'], color="#32D74B")
+            # 依跨度分桶 + 滾動最高/平均，再以 LTTB 壓到固定點數
+            metric = st.radio("趨勢指標", ["BPM", "SPS"], horizontal=True, label_visibility="collapsed")
+            buckets = get_trend_buckets(df, app.store_file, app.index.version(), note)
+            key = metric.lower()
+            chart_data = trends.downsample(buckets, f"max_{key}")[[f"max_{key}", f"mean_{key}"]]
+            chart_data.columns = [f"最高 {metric}", f"平均 {metric}"]
+            st.line_chart(chart_data, color=["#32D74B", "#8E8E93"])
+
+            # === 3. 進度分析 ===
+            report = get_practice_analytics(df, app.store_file, app.index.version(), note, now.date())
+            level_info, sps_pct = report["level"], report["sps"]
+            current_plateau = report["plateaus"][report["plateaus"]["current"]]
+            eta = f"約 {level_info['eta_days']} 天 ({level_info['eta_date']:%m/%d})" if level_info["eta_days"] else "近期沒有練習"
+            plateau_text = (f"已 {int(current_plateau['days'].iloc[0])} 天未刷新紀錄" if not current_plateau.empty
+                            else "持續進步中")
+            st.markdown(f"""
+            <div class="glass-card">
+                <div class="ios-subhead">{selected_tab} 進度</div>
+                <div class="ios-body">Chopper Lv.{level_info['level']} · 再 {int(np.ceil(level_info['minutes_to_next']))} 分鐘升級 · {eta}</div>
+                <div class="ios-body">快嘴最近 {analytics.PACE_DAYS} 天平均 {level_info['pace_per_day']:.1f} 分鐘/天 · {plateau_text}</div>
+                <div class="ios-caption">SPS 中位數 {sps_pct['p50']:.1f} · P90 {sps_pct['p90']:.1f} · P99 {sps_pct['p99']:.1f}</div>
+            </div>
+            """, unsafe_allow_html=True)
+            curve = trends.downsample(report["progression"], "rolling_best")[["personal_best", "rolling_best"]]
+            curve.columns = ["個人紀錄", f"近 {analytics.ROLLING_DAYS} 天最佳"]
+            st.line_chart(curve, color=["#32D74B", "#0A84FF"])
         else:
             st.info(f"尚無 {selected_tab} 的訓練記錄。")
 
         st.markdown('<div class="ios-subhead">各音符最高 BPM 紀錄</div>', unsafe_allow_html=True)
         if not df.empty:
-            best_scores = df.groupby('Note_Type')['BPM'].max().reset_index()
+            best_scores = app.index.best_by_note()
             st.dataframe(
                 best_scores.rename(columns={'Note_Type': '音符類型', 'BPM': '最高紀錄'}),
                 use_container_width=True,
                 hide_index=True
             )
+
+# ================= 🩺 診斷 (Diagnostics) =================
+elif st.session_state.page == "diagnostics":
+    import pandas as pd
+    st.markdown('<div class="ios-headline">診斷</div>', unsafe_allow_html=True)
+    snap = telemetry.snapshot()
+
+    # 上一次 rerun (通常是切過來之前的那一頁) 各段的時間，外層區段包含內層
+    st.markdown('<div class="ios-subhead">上一次 rerun (ms)</div>', unsafe_allow_html=True)
+    last_rerun = st.session_state.get("telemetry_rerun") or {}
+    if last_rerun:
+        rerun_df = pd.DataFrame(sorted(last_rerun.items(), key=lambda kv: -kv[1]), columns=["區段", "ms"])
+        st.dataframe(rerun_df.round(2), use_container_width=True, hide_index=True)
+    else:
+        st.info("尚無記錄，切到其他頁面操作後再回來。")
+
+    # 累計：GitHub API 呼叫與其他區段分開列 (背景同步執行緒的呼叫只在 RAP_TELEMETRY=1 時記錄)
+    timers = pd.DataFrame.from_dict(snap["timers"], orient="index").round(2)
+    if not timers.empty:
+        is_github = timers.index.str.startswith("github.")
+        if is_github.any():
+            st.markdown('<div class="ios-subhead">GitHub API</div>', unsafe_allow_html=True)
+            st.dataframe(timers[is_github], use_container_width=True)
+        st.markdown('<div class="ios-subhead">各區段累計</div>', unsafe_allow_html=True)
+        st.dataframe(timers[~is_github], use_container_width=True)
+    if snap["counters"]:
+        st.markdown('<div class="ios-subhead">計數</div>', unsafe_allow_html=True)
+        st.dataframe(pd.Series(snap["counters"], name="值").to_frame(), use_container_width=True)
+
+    if app.sync:
+        sync_state = app.sync
+        st.caption(f"上傳佇列 {len(sync_state.queue)} 筆 · 上次同步 {sync_state.last_sync or '—'}"
+                   f" · 錯誤 {sync_state.last_error or '無'}")
+
+    c_json, c_prom, c_reset = st.columns(3)
+    with c_json:
+        st.download_button("JSON", lambda: telemetry.to_json(), "telemetry.json", "application/json",
+                           use_container_width=True)
+    with c_prom:
+        st.download_button("Prometheus", lambda: telemetry.to_prometheus(), "telemetry.prom", "text/plain",
+                           use_container_width=True)
+    with c_reset:
+        st.button("清除", on_click=telemetry.reset, use_container_width=True)
+
+# --- 6. 首次繪製之後 ---
+telemetry.record(f"page.{st.session_state.page}", time.perf_counter() - _page_start)
+st.session_state.render_ms = (time.perf_counter() - _script_start) * 1000
+telemetry.record("rerun", st.session_state.render_ms / 1000)
+if st.session_state.page != "diagnostics":
+    st.session_state.telemetry_rerun = telemetry.rerun_timings()
+if st.query_params.get("debug") == "1":
+    st.caption(f"render {st.session_state.render_ms:.0f} ms")
+    st.button("🩺 診斷", on_click=nav_to, args=("diagnostics",))
+# 頁面內容都送出後才啟動 GitHub 背景同步 (補傳上次還沒送出的記錄)
+app.start_sync()
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import heatmap
+import notes
+import rhythm
+import telemetry
+from aggregates import HistoryIndex
+from reconcile import merge_histories
+from storage import COLUMNS, HistoryCache, SessionLog, write_arrow
+from sync import GithubSync, LocalRepo
+from settings import save_settings, settings_path
+from sqlite_store import SqliteHistoryCache, SqliteLog
+from transfer import export_csv_file
+
+# --- 效能基準測試 ---
+# python bench.py                         # 1k ~ 1M 筆
+# python bench.py --sizes 1000 10000000   # 最多到 10M
+# python bench.py --save-baseline         # 記錄基準
+# python bench.py --compare               # 與基準比較，變慢就回傳 1
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+BASELINE_FILE = "bench_baseline.json"
+NOTE_TYPES = ["1/4", "1/8", "1/3", "1/16", "1/16 (十六分音符 - 快嘴)"]
+NOTE_MULT = [1, 2, 3, 4, 4]
+TAB_NOTES = ["1/16", "1/8", "1/3"]
+
+
+def synthetic_history(n, seed=0, years=5):
+    # 與 rap_log_v8.csv 相同欄位；日期遞增，跨 years 年
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2021-01-01T00:00:00", "us")
+    span_us = years * 365 * 86400 * 10**6
+    offsets = np.sort(rng.integers(0, span_us, n))
+    notes = rng.integers(0, len(NOTE_TYPES), n)
+    bpm = rng.integers(60, 201, n)
+    return pd.DataFrame({
+        'Date': start + offsets.astype("timedelta64[us]"),
+        'BPM': bpm,
+        'Note_Type': np.array(NOTE_TYPES, dtype=object)[notes],
+        'SPS': bpm * np.array(NOTE_MULT)[notes] / 60,
+        'Duration': np.round(rng.uniform(0.5, 30, n), 2),
+        'Focus': "Auto-log",
+    }, columns=COLUMNS)
+
+
+def click_track(path, bpm=90, subdivisions=4, seconds=60, sr=44100, seed=0):
+    # 練習錄音的替身：每個十六分音符一記短促的敲擊 (±8 ms 抖動) + 底噪，16-bit 單聲道 WAV
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0, 0.003, int(seconds * sr))
+    hit = np.exp(-np.arange(int(0.04 * sr)) / (0.008 * sr)) * rng.normal(0, 0.3, int(0.04 * sr))
+    times = np.arange(0.5, seconds - 0.5, 60 / (bpm * subdivisions))
+    for t in times + rng.normal(0, 0.008, size=len(times)):
+        i = int(t * sr)
+        x[i:i + len(hit)] += hit[:len(x) - i]
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes((np.clip(x, -1, 1) * 32767).astype('<i2').tobytes())
+
+
+def new_entry():
+    return {'Date': datetime.now(), 'BPM': 120, 'Note_Type': "1/16", 'SPS': 8.0, 'Duration': 3.5, 'Focus': "Auto-log"}
+
+
+def measure(fn, repeat):
+    # 時間取最佳值；記憶體另外跑一次 (tracemalloc 會拖慢速度)
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": best, "peak_mb": peak / 2**20}
+
+
+def bench_size(n, workdir):
+    df = synthetic_history(n)
+    csv_file = os.path.join(workdir, "rap_log_v8.csv")
+    arrow_file = os.path.join(workdir, "rap_log_v8.arrow")
+    df.to_csv(csv_file, index=False)
+    write_arrow(df, arrow_file)
+    repeat = 5 if n <= 100_000 else 1
+    results = {}
+
+    # load_data：整份讀取 (CSV / Arrow)、rerun 命中快取、追加一筆後的增量讀取
+    results["load_csv"] = measure(lambda: SessionLog(csv_file).read(), repeat)
+    results["load_arrow"] = measure(lambda: SessionLog(arrow_file).read(), repeat)
+    cache = HistoryCache(SessionLog(csv_file, compact_every=10**9))
+    cache.load()
+    results["load_rerun_cached"] = measure(cache.load, repeat)
+
+    def append_then_load():
+        cache.log.append(new_entry())
+        cache.load()
+    results["load_rerun_incremental"] = measure(append_then_load, repeat)
+
+    # 存檔：追加一筆 vs 整份覆寫
+    log = SessionLog(os.path.join(workdir, "save.csv"), compact_every=10**9)
+    results["save_append"] = measure(lambda: log.append(new_entry()), repeat)
+    results["save_rewrite"] = measure(lambda: log.rewrite(df), repeat)
+
+    # 8 個 session 同時存檔 (各 25 筆)，走同一把檔案鎖
+    def concurrent_appends(writers=8, per_writer=25):
+        threads = [threading.Thread(target=lambda: [log.append(new_entry()) for _ in range(per_writer)])
+                   for _ in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    results["save_append_8_writers"] = measure(concurrent_appends, repeat)
+
+    # SQLite 後端 (多程序部署)：第一次開啟時從同資料夾的 Arrow 快照搬入，之後整份讀取 / 追加後的增量讀取 / 追加一筆
+    sqlite_log = SqliteLog(os.path.join(workdir, "rap_log_v8.db"))
+    sqlite_cache = SqliteHistoryCache(sqlite_log)
+    results["sqlite_load"] = measure(lambda: (sqlite_cache.invalidate(), sqlite_cache.load()), repeat)
+
+    def sqlite_append_then_load():
+        sqlite_log.append(new_entry())
+        sqlite_cache.load()
+    results["sqlite_rerun_incremental"] = measure(sqlite_append_then_load, repeat)
+    results["sqlite_append"] = measure(lambda: sqlite_log.append(new_entry()), repeat)
+
+    # get_chopper_minutes / 統計頁：舊的逐列字串掃描 vs 整數代碼 vs 摘要索引
+    raw_notes = df['Note_Type']
+    results["note_normalize"] = measure(lambda: notes.normalize(raw_notes), repeat)
+    df['Note_Type'] = notes.normalize(raw_notes)  # 與載入後的狀態相同
+    index = HistoryIndex.from_frame(df)
+    results["index_build"] = measure(lambda: HistoryIndex.from_frame(df), repeat)
+    results["chopper_scan"] = measure(
+        lambda: df[raw_notes.str.contains("1/16", na=False)]['Duration'].sum(), repeat)
+    results["chopper_codes"] = measure(lambda: df['Duration'].to_numpy()[notes.mask(df['Note_Type'], "1/16")].sum(), repeat)
+    results["chopper_index"] = measure(lambda: index.minutes("1/16"), repeat)
+
+    def stats_filters():
+        for note in TAB_NOTES:
+            index.max_bpm(note)
+            index.mean_bpm(note)
+            df[notes.mask(df['Note_Type'], note)].sort_values('Date')
+        index.best_by_note()
+    results["stats_filters"] = measure(stats_filters, repeat)
+
+    # 輸出 CSV：舊的整份字串 + bytes vs 分塊寫暫存檔
+    results["export_to_csv_bytes"] = measure(lambda: df.to_csv(index=False).encode('utf-8'), repeat)
+    results["export_chunked"] = measure(lambda: export_csv_file(df).close(), repeat)
+
+    # 日曆：整段歷史的每日分鐘數 (app 以歷史指紋快取)，之後本月/今年/全部三種元件資料與連續打卡
+    last = df['Date'].iloc[-1]
+    today = np.datetime64(last, 'D')
+    first = heatmap.to_days(df['Date']).min()
+    results["calendar_daily"] = measure(lambda: heatmap.daily_minutes(df['Date'], df['Duration'], first, today), repeat)
+    all_minutes = heatmap.daily_minutes(df['Date'], df['Duration'], first, today)
+
+    def render_calendar():
+        for view, start in (("month", today.astype('datetime64[M]').astype('datetime64[D]')),
+                            ("year", np.datetime64(f"{last.year}-01-01", 'D')), ("years", first)):
+            heatmap.calendar_html(view, start, heatmap.slice_days(first, all_minutes, start, today), today)
+        heatmap.streaks(heatmap.active_days(df['Date']), last)
+    results["calendar"] = measure(render_calendar, repeat)
+
+    # GitHub：本地替身，量測冷啟動讀取與一批 10 筆上傳
+    remote = os.path.join(workdir, "remote")
+    sync = GithubSync(lambda: LocalRepo(remote), "rap_log_v8.csv", "main", os.path.join(workdir, "sync.jsonl"))
+    sync.push_full(df)
+
+    def cold_view():
+        fresh = GithubSync(lambda: LocalRepo(remote), "rap_log_v8.csv", "main",
+                           os.path.join(workdir, "sync.jsonl"), cache_dir=tempfile.mkdtemp(dir=workdir))
+        fresh.view()
+    results["github_load_cold"] = measure(cold_view, 1)
+
+    def flush_batch():
+        for _ in range(10):
+            sync.queue.put(new_entry())
+        sync.flush_once()
+    results["github_flush_10"] = measure(flush_batch, repeat)
+
+    # 進度分析：快嘴 (1/16) 的個人紀錄曲線、升級預估、停滯期、SPS 百分位
+    results["analytics_summary"] = measure(lambda: analytics.summary(df, "1/16", last), repeat)
+
+    # 對帳：整份本地 vs 遠端 (各缺幾筆) 的差集計算
+    local, remote_df = df, df.iloc[:-10]
+    results["reconcile_diff"] = measure(lambda: merge_histories(local, remote_df), repeat)
+
+    # 錄音節奏分析：60 秒 WAV 的起音偵測 + 評分 (單一程序，分段讀取)
+    recording = os.path.join(workdir, "take.wav")
+    click_track(recording)
+    results["rhythm_60s"] = measure(lambda: rhythm.analyze(recording, 90, "1/16", workers=1), repeat)
+    # 同一段錄音交給子程序池 (spawn，含開程序與子程序載入模組的成本)
+    results["rhythm_60s_pool"] = measure(lambda: rhythm.analyze(recording, 90, "1/16", workers=4), 1)
+
+    # 計時裝飾器本身的成本：關閉 / 開啟時各呼叫 10 萬次空函式
+    noop = telemetry.timed("bench.noop")(lambda: None)
+
+    def call_noop():
+        for _ in range(100_000):
+            noop()
+    was_enabled = telemetry.enabled()
+    for state in (False, True):
+        telemetry.enable(state)
+        results[f"telemetry_{'on' if state else 'off'}_100k"] = measure(call_noop, repeat)
+    telemetry.enable(was_enabled)
+    return results
+
+
+# --- 冷啟動 (首次繪製) ---
+# 在全新的 Python 程序裡跑第一次腳本：量到頁面內容全部送出為止的時間，並檢查有沒有多載入 pandas
+# 節拍器頁不讀歷史，預算跟筆數無關；主頁/數據頁要讀整份歷史，只在 COLD_START_MAX_ROWS 以內檢查
+COLD_START_BUDGET = {"metronome": 0.5, "home": 2.0, "stats": 3.0}
+COLD_START_MAX_ROWS = 100_000
+APP_MODULES = ["app.py", "aggregates.py", "analytics.py", "heatmap.py", "locking.py", "metronome.py", "notes.py",
+               "programs.py", "reconcile.py", "rhythm.py", "settings.py", "sqlite_store.py", "storage.py", "sync.py",
+               "telemetry.py", "tracker.py", "transfer.py", "trends.py", "users.py"]
+_COLD_START_SCRIPT = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=600)
+at.session_state.page = sys.argv[2]
+at.run()
+assert not at.exception, at.exception
+# app.py 自己記錄的時間 (腳本第一行到頁面內容送完)，不含 AppTest/Streamlit 本身的啟動
+print(at.session_state.render_ms / 1000, int("pandas" in sys.modules))
+"""
+
+
+def cold_start(workdir, page):
+    import subprocess
+    out = subprocess.run([sys.executable, "-c", _COLD_START_SCRIPT, os.path.join(workdir, "app.py"), page],
+                         cwd=workdir, capture_output=True, text=True, check=True).stdout.split()
+    return {"seconds": float(out[-2]), "peak_mb": 0.0, "pandas": out[-1] == "1"}
+
+
+def bench_cold_start(n, workdir):
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in APP_MODULES:
+        shutil.copy(os.path.join(here, name), workdir)
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w").close()
+    save_settings(settings_path(os.path.join(workdir, "rap_log_v8.csv")), bpm=120)
+    results, over = {}, []
+    for page, budget in COLD_START_BUDGET.items():
+        result = cold_start(workdir, page)
+        results[f"cold_start_{page}"] = result
+        if (page == "metronome" or n <= COLD_START_MAX_ROWS) and result["seconds"] > budget:
+            over.append((str(n), page, budget, result["seconds"]))
+    return results, over
+
+
+def compare(current, baseline, tolerance, min_seconds=0.001):
+    regressions = []
+    for size, paths in current.items():
+        for path, result in paths.items():
+            base = baseline.get(size, {}).get(path)
+            if not base:
+                continue
+            slower = result["seconds"] > base["seconds"] * (1 + tolerance)
+            if slower and result["seconds"] - base["seconds"] > min_seconds:
+                regressions.append((size, path, base["seconds"], result["seconds"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rap Trainer data path benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown ratio before flagging")
+    parser.add_argument("--skip-cold-start", action="store_true", help="skip the per-page first render runs")
+    args = parser.parse_args(argv)
+
+    current, over_budget = {}, []
+    for n in args.sizes:
+        workdir = tempfile.mkdtemp(prefix="rap_bench_")
+        try:
+            current[str(n)] = bench_size(n, workdir)
+            if not args.skip_cold_start:
+                cold, over = bench_cold_start(n, workdir)
+                current[str(n)].update(cold)
+                over_budget += over
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(f"\n== {n:,} sessions ==")
+        for path, r in current[str(n)].items():
+            note = "  (pandas loaded)" if r.get("pandas") else ""
+            memory = "      n/a" if "pandas" in r else f"{r['peak_mb']:9.1f}"
+            print(f"  {path:<24} {r['seconds'] * 1000:10.2f} ms  {memory} MB peak{note}")
+
+    for size, page, budget, seconds in over_budget:
+        print(f"OVER BUDGET {size} cold_start_{page}: {seconds * 1000:.0f} ms > {budget * 1000:.0f} ms")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nbaseline saved -> {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\nno baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        for size, path, before, after in regressions:
+            print(f"REGRESSION {size} {path}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+        if regressions:
+            return 1
+        print("\nno regressions")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import base64
+import calendar
+import json
+from string import Template
+
+import numpy as np
+
+import telemetry
+
+# --- 日曆 / 連續打卡引擎 ---
+# 全部以 datetime64[D] 向量運算，不在 Python 迴圈裡逐筆處理
+# 1970-01-01 是星期四：(天數 + 3) % 7 得到週一 = 0 的星期
+_EPOCH_WEEKDAY = 3
+LEVEL_BOUNDS = [0.01, 10, 20, 40]
+
+
+def to_days(dates):
+    return np.asarray(dates).astype('datetime64[D]')
+
+
+def weekday(days):
+    return (days.astype(np.int64) + _EPOCH_WEEKDAY) % 7
+
+
+@telemetry.timed("heatmap.daily_minutes")
+def daily_minutes(dates, durations, start, end):
+    # [start, end] 每一天的練習分鐘數
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    n = int((end - start).astype(np.int64)) + 1
+    if n <= 0:
+        return np.zeros(0)
+    offsets = (to_days(dates) - start).astype(np.int64)
+    mask = (offsets >= 0) & (offsets < n)
+    weights = np.asarray(durations, dtype=np.float64)[mask]
+    return np.bincount(offsets[mask], weights=weights, minlength=n)
+
+
+def active_days(dates):
+    return np.unique(to_days(dates))
+
+
+def streaks(days, today):
+    # days：排序、不重複的練習日；回傳 (目前連續天數, 最長連續天數)
+    # 今天還沒練但昨天有練，連續紀錄仍算數
+    days = np.asarray(days, dtype='datetime64[D]')
+    if len(days) == 0:
+        return 0, 0
+    breaks = np.flatnonzero(np.diff(days).astype(np.int64) != 1)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(days) - 1]))
+    lengths = ends - starts + 1
+    gap = int((np.datetime64(today, 'D') - days[-1]).astype(np.int64))
+    current = int(lengths[-1]) if 0 <= gap <= 1 else 0
+    return current, int(lengths.max())
+
+
+# --- 日曆元件 (瀏覽器端繪製) ---
+# 伺服器只送每天分鐘數：uint16 little-endian 再 base64 (一天 2 bytes，5 年約 5 KB)，
+# 格子、顏色、月份標籤都在 iframe 裡由 JS 畫；範圍變大時伺服器端只多一段 bincount 與編碼
+# view：month (月曆) / year (GitHub 式熱度圖) / years (每年一列熱度圖，最新的在上)
+VIEWS = ("month", "year", "years")
+MAX_MINUTES = np.iinfo(np.uint16).max
+
+_COMPONENT = Template("""
+<div id="rap-calendar"></div>
+<style>
+    body { margin: 0; font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif; color: #FFFFFF; }
+    .card { background: #1C1C1E; border: 1px solid rgba(255, 255, 255, 0.1); border-radius: 20px;
+            padding: 20px 24px; margin-bottom: 12px; }
+    .title { font-size: 13px; font-weight: 600; color: #8E8E93; text-transform: uppercase; letter-spacing: 0.5px; }
+    table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+    th { color: #8E8E93; font-size: 12px; padding-bottom: 10px; text-transform: uppercase; }
+    td { text-align: center; padding: 4px 0; height: 36px; width: 14.28%; }
+    .day { display: inline-flex; justify-content: center; align-items: center; width: 32px; height: 32px;
+           border-radius: 50%; font-size: 14px; font-weight: 600; color: #555; }
+    .day.active { background: #32D74B; color: #FFFFFF; box-shadow: 0 0 10px rgba(50, 215, 75, 0.4); }
+    .day.today { border: 2px solid #FFFFFF; }
+    .months { position: relative; height: 14px; margin-top: 8px; font-size: 10px; color: #8E8E93; }
+    .months span { position: absolute; }
+    .grid { display: grid; grid-template-rows: repeat(7, 10px); grid-auto-flow: column; grid-auto-columns: 10px;
+            gap: 3px; overflow-x: auto; margin-top: 4px; }
+    .grid i { display: block; width: 10px; height: 10px; border-radius: 2px; }
+    .l0 { background: #2C2C2E; } .l1 { background: #0E4429; } .l2 { background: #006D32; }
+    .l3 { background: #26A641; } .l4 { background: #32D74B; } .pad { visibility: hidden; }
+</style>
+<script>
+(function() {
+    var P = $payload;
+    var DAY = 86400000, COLUMN = 13;
+    var MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+                  'October', 'November', 'December'];
+    var raw = atob(P.data), n = raw.length >> 1, minutes = new Uint16Array(n);
+    for (var i = 0; i < n; i++) minutes[i] = raw.charCodeAt(2 * i) | (raw.charCodeAt(2 * i + 1) << 8);
+
+    function parse(s) { var p = s.split('-'); return Date.UTC(+p[0], +p[1] - 1, +p[2]); }
+    var start = parse(P.start), today = parse(P.today);
+    function at(t) { var k = Math.round((t - start) / DAY); return k >= 0 && k < n ? minutes[k] : 0; }
+    function weekday(t) { return (new Date(t).getUTCDay() + 6) % 7; }  // 週一 = 0
+    function level(m) { var l = 0; for (var b = 0; b < P.bounds.length; b++) if (m >= P.bounds[b]) l = b + 1; return l; }
+    function el(tag, cls, text) {
+        var e = document.createElement(tag);
+        if (cls) e.className = cls;
+        if (text !== undefined) e.textContent = text;
+        return e;
+    }
+    function card(title) {
+        var c = el('div', 'card');
+        c.appendChild(el('div', 'title', title));
+        document.getElementById('rap-calendar').appendChild(c);
+        return c;
+    }
+
+    function month() {
+        var d = new Date(start), y = d.getUTCFullYear(), m = d.getUTCMonth();
+        var c = card(MONTHS[m] + ' ' + y), table = el('table'), head = el('tr'), body = el('tbody');
+        ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su'].forEach(function(w) { head.appendChild(el('th', '', w)); });
+        table.appendChild(el('thead')).appendChild(head);
+        var last = Date.UTC(y, m + 1, 1) - DAY, row = el('tr');
+        for (var k = 0; k < weekday(start); k++) row.appendChild(el('td'));
+        for (var t = start; t <= last; t += DAY) {
+            var cls = 'day' + (at(t) > 0 ? ' active' : '') + (t === today ? ' today' : '');
+            row.appendChild(el('td')).appendChild(el('div', cls, new Date(t).getUTCDate()));
+            if (weekday(t) === 6) { body.appendChild(row); row = el('tr'); }
+        }
+        if (row.children.length) body.appendChild(row);
+        table.appendChild(body);
+        c.appendChild(table);
+    }
+
+    function heatmap(from, to, title) {
+        var total = 0;
+        for (var t = from; t <= to; t += DAY) total += at(t);
+        var c = card(title + ' · ' + total + ' 分鐘'), labels = el('div', 'months'), grid = el('div', 'grid');
+        for (var k = 0; k < weekday(from); k++) grid.appendChild(el('i', 'pad'));
+        for (var t = from, col = 0; t <= to; t += DAY) {
+            var d = new Date(t);
+            if (d.getUTCDate() === 1 || t === from) {
+                var label = labels.appendChild(el('span', '', MONTHS[d.getUTCMonth()].slice(0, 3)));
+                label.style.left = (col * COLUMN) + 'px';
+            }
+            var m = at(t);
+            var cell = grid.appendChild(el('i', 'l' + level(m)));
+            if (m) cell.title = new Date(t).toISOString().slice(0, 10) + ' · ' + m + ' min';
+            if (weekday(t) === 6) col++;
+        }
+        c.appendChild(labels);
+        c.appendChild(grid);
+    }
+
+    if (P.view === 'month') {
+        month();
+    } else if (P.view === 'year') {
+        heatmap(start, today, P.title);
+    } else {
+        for (var y = new Date(today).getUTCFullYear(); y >= new Date(start).getUTCFullYear(); y--) {
+            heatmap(Math.max(start, Date.UTC(y, 0, 1)), Math.min(today, Date.UTC(y, 11, 31)), String(y));
+        }
+    }
+})();
+</script>
+""")
+
+
+def pack_minutes(minutes):
+    # 每天分鐘數 -> base64(uint16 LE)；有練習但不到 1 分鐘的算 1，才不會在圖上消失
+    packed = np.clip(np.ceil(np.asarray(minutes, dtype=np.float64)), 0, MAX_MINUTES).astype('<u2')
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def slice_days(first, minutes, start, end):
+    # minutes 從 first 那天開始；取出 [start, end]，範圍外補 0
+    first, start, end = (np.datetime64(d, 'D') for d in (first, start, end))
+    n = max(int((end - start).astype(np.int64)) + 1, 0)
+    out = np.zeros(n)
+    lo = int((start - first).astype(np.int64))
+    src = slice(max(lo, 0), min(lo + n, len(minutes)))
+    if src.start < src.stop:
+        out[src.start - lo:src.stop - lo] = minutes[src]
+    return out
+
+
+def calendar_payload(view, start, minutes, today, title=""):
+    # start：minutes[0] 那一天；month 檢視時 start 必須是該月 1 日
+    if view not in VIEWS:
+        raise ValueError(f"unknown calendar view: {view}")
+    return {"view": view, "start": str(np.datetime64(start, 'D')), "today": str(np.datetime64(today, 'D')),
+            "title": title, "bounds": LEVEL_BOUNDS, "data": pack_minutes(minutes)}
+
+
+def calendar_height(view, start, today):
+    # components.html 需要先給高度 (px)
+    start, today = np.datetime64(start, 'D'), np.datetime64(today, 'D')
+    if view == "month":
+        days = calendar.monthrange(*map(int, str(start)[:7].split("-")))[1]
+        weeks = -(-(int(weekday(start)) + days) // 7)
+        return 100 + 44 * weeks
+    years = 1 if view == "year" else int(str(today)[:4]) - int(str(start)[:4]) + 1
+    return 180 * years
+
+
+@telemetry.timed("heatmap.calendar_html")
+def calendar_html(view, start, minutes, today, title=""):
+    payload = json.dumps(calendar_payload(view, start, minutes, today, title), ensure_ascii=False)
+    return _COMPONENT.substitute(payload=payload)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+from string import Template
+
+# --- 節拍器引擎 (Web Audio look-ahead 排程) ---
+# 計時器只負責「提早排程」：每 LOOKAHEAD_MS 醒來一次，把接下來 SCHEDULE_AHEAD_S 秒內的音
+# 用 audioCtx.currentTime 的絕對時間排好。主執行緒卡頓只會讓排程晚一點，不會讓聲音飄掉。
+#
+# 引擎只安裝一次在 Streamlit 主頁面 (window.parent)，rerun 重建 iframe 也不會中斷；
+# 每次 rerun 的 iframe 只送一則 {type: 'rap-metronome', params} 訊息，
+# BPM / 音符 / Ghost 的變更在下一個小節線才生效，開始/停止則立即生效。
+# 訓練計畫：params.program 帶整份階梯 ({id, steps: [[BPM, 細分, Ghost, 小節數], ...], from})，
+# 引擎自己數小節、在小節線換階，播完最後一階自動停止；同一個 id 重送 (rerun) 不會從頭開始。
+LOOKAHEAD_MS = 25
+SCHEDULE_AHEAD_S = 0.1
+MESSAGE_TYPE = "rap-metronome"
+
+_ENGINE = Template("""
+(function() {
+    var LOOKAHEAD_MS = $lookahead_ms;
+    var SCHEDULE_AHEAD = $schedule_ahead;
+    var Ctx = window.AudioContext || window.webkitAudioContext;
+    var engine = window.rapMetronome = {version: '$version', cfg: null, pending: null, timer: null, stats: null,
+                                        program: null};
+    var ctx = null, voices = null;
+
+    // 音色只合成一次 (與舊版 oscillator 相同的頻率/包絡)，每拍只建立輕量的 BufferSource
+    function synth(wave, dur, f0, f1, g0) {
+        var sr = ctx.sampleRate, n = Math.ceil(dur * sr);
+        var buf = ctx.createBuffer(1, n, sr), data = buf.getChannelData(0), phase = 0;
+        for (var i = 0; i < n; i++) {
+            var k = i / n;
+            var f = f0 * Math.pow(f1 / f0, k);
+            var g = g0 * Math.pow(0.01 / g0, k);
+            phase += f / sr;
+            var p = phase % 1;
+            var s = wave === 'square' ? (p < 0.5 ? 1 : -1)
+                  : wave === 'triangle' ? 1 - 4 * Math.abs(p - 0.5)
+                  : Math.sin(2 * Math.PI * p);
+            data[i] = s * g;
+        }
+        return buf;
+    }
+
+    function ensureAudio() {
+        if (!ctx) {
+            ctx = new Ctx();
+            var out = ctx.createGain();
+            out.connect(ctx.destination);
+            voices = {
+                kick: synth('sine', 0.5, 150, 0.01, 1),
+                snare: synth('triangle', 0.1, 300, 300, 0.4),
+                hihat: synth('square', 0.05, 800, 800, 0.2),
+                out: out
+            };
+        }
+        if (ctx.state === 'suspended') ctx.resume();
+    }
+
+    function play(name, when) {
+        var src = ctx.createBufferSource();
+        src.buffer = voices[name];
+        src.connect(voices.out);
+        src.start(when);
+    }
+
+    // 目前區段：起點時間 + 第幾個 tick，由起點直接乘出來，不累加浮點誤差
+    var seg = {start: 0, index: 0, tick: 0};
+    var bar = 0, pos = 0, lastWake = null, perf0 = null, ctx0 = null;
+
+    function noteTime() { return seg.start + seg.index * seg.tick; }
+
+    function startSegment(at) {
+        seg.start = at;
+        seg.index = 0;
+        seg.tick = 60 / engine.cfg.bpm / engine.cfg.subdivisions;
+        engine.stats.bpm = engine.cfg.bpm;
+        engine.stats.subdivisions = engine.cfg.subdivisions;
+        if (engine.program) engine.stats.step = engine.program.index;
+    }
+
+    function stepParams(step) {
+        return {bpm: step[0], subdivisions: step[1], ghost: step[2], playing: true};
+    }
+
+    // 計畫：目前這階的小節數走完就在這條小節線換下一階；回傳 false 表示整份播完
+    function advanceProgram() {
+        var p = engine.program;
+        if (p.barsLeft > 0) return true;
+        p.index++;
+        if (p.index >= p.steps.length) return false;
+        p.barsLeft = p.steps[p.index][3];
+        engine.pending = stepParams(p.steps[p.index]);
+        return true;
+    }
+
+    function schedule() {
+        var now = ctx.currentTime, wake = performance.now();
+        var stats = engine.stats;
+        // 量測：計時器延遲，以及音訊時鐘相對系統時鐘的漂移
+        if (lastWake !== null) stats.maxJitterMs = Math.max(stats.maxJitterMs, wake - lastWake - LOOKAHEAD_MS);
+        lastWake = wake;
+        if (perf0 === null) { perf0 = wake; ctx0 = now; }
+        stats.clockDriftMs = (wake - perf0) - (now - ctx0) * 1000;
+
+        while (true) {
+            if (pos === 0 && engine.program && !advanceProgram()) {
+                stop();
+                stats.done = true;
+                return;
+            }
+            // 小節線：套用排隊中的新參數
+            if (pos === 0 && engine.pending) {
+                var at = noteTime();
+                engine.cfg = engine.pending;
+                engine.pending = null;
+                startSegment(at);
+            }
+            var cfg = engine.cfg;
+            var when = noteTime();
+            if (when >= now + SCHEDULE_AHEAD) break;
+            var lead = (when - now) * 1000;
+            stats.notes++;
+            stats.minLeadMs = stats.minLeadMs === null ? lead : Math.min(stats.minLeadMs, lead);
+            if (lead < 0) stats.late++;
+
+            var isGhostBar = cfg.ghost && ((bar + 1) % 4 === 0);
+            if (!isGhostBar) {
+                if (pos === 0) play('kick', Math.max(when, now));
+                else if (pos % cfg.subdivisions === 0) play('snare', Math.max(when, now));
+                else play('hihat', Math.max(when, now));
+            }
+            seg.index++;
+            pos++;
+            if (pos >= 4 * cfg.subdivisions) {
+                pos = 0;
+                bar++;
+                if (engine.program) engine.program.barsLeft--;
+            }
+        }
+    }
+
+    function start(params) {
+        ensureAudio();
+        engine.cfg = params;
+        engine.pending = null;
+        engine.stats = {bpm: 0, subdivisions: 0, notes: 0, late: 0, minLeadMs: null, maxJitterMs: 0, clockDriftMs: 0,
+                        step: null, done: false};
+        bar = 0; pos = 0; lastWake = null; perf0 = null;
+        startSegment(ctx.currentTime + 0.05);
+        engine.timer = setInterval(schedule, LOOKAHEAD_MS);
+        schedule();
+    }
+
+    function stop() {
+        if (engine.timer) clearInterval(engine.timer);
+        engine.timer = null;
+        engine.pending = null;
+    }
+
+    function same(a, b) {
+        return a && b && a.bpm === b.bpm && a.subdivisions === b.subdivisions && a.ghost === b.ghost;
+    }
+
+    // 從第 from 階開始 (斷線重連後接回計畫時不從頭來)；已經播完就不再開始
+    function startProgram(program) {
+        var index = program.from || 0;
+        if (index >= program.steps.length) return;
+        engine.program = {id: program.id, steps: program.steps, index: index, barsLeft: program.steps[index][3]};
+        start(stepParams(program.steps[index]));
+    }
+
+    engine.update = function(params) {
+        if (!params.playing) { stop(); engine.cfg = params; engine.program = null; return; }
+        if (params.program) {
+            if (engine.program && engine.program.id === params.program.id) return;
+            stop();
+            engine.program = null;
+            startProgram(params.program);
+            return;
+        }
+        if (!engine.timer || engine.program) { stop(); engine.program = null; start(params); return; }
+        engine.pending = same(params, engine.cfg) ? null : params;
+    };
+
+    function onMessage(e) {
+        if (e.data && e.data.type === '$message_type') engine.update(e.data.params);
+    }
+    window.addEventListener('message', onMessage);
+
+    engine.dispose = function() {
+        stop();
+        window.removeEventListener('message', onMessage);
+        if (ctx) ctx.close();
+    };
+})();
+""")
+
+_BRIDGE = Template("""
+<div id="metronome-stats" style="font: 12px -apple-system, sans-serif; color: #8E8E93; text-align: center;"></div>
+<script>
+(function() {
+    // 引擎裝在主頁面；拿不到 parent (跨來源) 時退回裝在 iframe 自己身上
+    var host = window.parent;
+    try { host.document; } catch (e) { host = window; }
+    if (!host.rapMetronome || host.rapMetronome.version !== '$version') {
+        if (host.rapMetronome) host.rapMetronome.dispose();
+        var script = host.document.createElement('script');
+        script.textContent = $engine;
+        host.document.head.appendChild(script);
+    }
+    host.postMessage({type: '$message_type', params: $params}, '*');
+
+    if ($show_stats) {
+        setInterval(function() {
+            var s = host.rapMetronome && host.rapMetronome.stats;
+            if (!s) return;
+            document.getElementById('metronome-stats').textContent =
+                s.bpm + ' BPM x' + s.subdivisions + (s.step === null ? '' : ' · step ' + (s.step + 1)) +
+                (s.done ? ' · done' : '') + ' · ' + s.notes + ' notes · late ' + s.late +
+                ' · min lead ' + (s.minLeadMs === null ? '-' : s.minLeadMs.toFixed(1)) + ' ms' +
+                ' · timer jitter ' + s.maxJitterMs.toFixed(1) + ' ms' +
+                ' · clock drift ' + s.clockDriftMs.toFixed(2) + ' ms';
+        }, 250);
+    }
+})();
+</script>
+""")
+
+_ENGINE_SETTINGS = dict(lookahead_ms=LOOKAHEAD_MS, schedule_ahead=SCHEDULE_AHEAD_S, message_type=MESSAGE_TYPE)
+# 引擎程式碼改版時換版本號，舊引擎會被停掉重裝
+ENGINE_VERSION = hashlib.sha1(_ENGINE.substitute(version="", **_ENGINE_SETTINGS).encode("utf-8")).hexdigest()[:8]
+ENGINE_JS = _ENGINE.substitute(version=ENGINE_VERSION, **_ENGINE_SETTINGS)
+
+
+def metronome_html(bpm, subdivisions, ghost, playing, show_stats=False, program=None):
+    # program：{"id": 練習 ID, "steps": programs.compile_program(...), "from": 從第幾階開始}
+    params = {"bpm": int(bpm), "subdivisions": int(subdivisions), "ghost": bool(ghost), "playing": bool(playing),
+              "program": program}
+    return _BRIDGE.substitute(
+        version=ENGINE_VERSION,
+        engine=json.dumps(ENGINE_JS),
+        message_type=MESSAGE_TYPE,
+        params=json.dumps(params),
+        show_stats="true" if show_stats else "false",
+    )
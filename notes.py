@@ -0,0 +1,89 @@
+from functools import lru_cache
+
+# --- 音符類型登錄表 ---
+# 標準標籤與每拍音節數；在表中的位置就是整數代碼 (0 = 1/4 ... 3 = 1/16)，只能往後加
+# 舊版標籤 (例如 v3 的 "1/16 (十六分音符 - 快嘴)") 在讀入時一次轉成標準標籤，
+# 記憶體中以固定類別的 Categorical 存放，篩選只比對整數代碼
+# 登錄表以外的標籤 (使用者自訂) 原樣保留：接在標準類別後面 (代碼 >= len(NOTE_LABELS))，寫回時不會遺失
+# 節拍器頁只用到登錄表本身，pandas / numpy 等到真的要處理欄位時才載入
+NOTE_MULTIPLIERS = {"1/4": 1, "1/8": 2, "1/3": 3, "1/16": 4}
+NOTE_LABELS = list(NOTE_MULTIPLIERS)
+UNKNOWN = -1
+
+
+@lru_cache(maxsize=None)
+def note_dtype():
+    import pandas as pd
+    return pd.CategoricalDtype(NOTE_LABELS)
+
+
+def canonical(label):
+    # 舊標籤的開頭就是標準標籤，後面接說明文字；認不得的回傳 None
+    if not isinstance(label, str):  # None / NaN / pd.NA
+        return None
+    text = label.strip()
+    if text in NOTE_MULTIPLIERS:
+        return text
+    head = (text.split("(")[0].split() or [""])[0]
+    return head if head in NOTE_MULTIPLIERS else None
+
+
+def code(label):
+    note = canonical(label)
+    return NOTE_LABELS.index(note) if note is not None else UNKNOWN
+
+
+def multiplier(label, default=1):
+    note = canonical(label)
+    return NOTE_MULTIPLIERS[note] if note is not None else default
+
+
+def _is_normalized(dtype):
+    # 前幾個類別就是登錄表 (後面可能接自訂標籤)
+    import pandas as pd
+    return isinstance(dtype, pd.CategoricalDtype) and list(dtype.categories[:len(NOTE_LABELS)]) == NOTE_LABELS
+
+
+def _custom(label):
+    # 登錄表以外的標籤：去掉前後空白後原樣保留；空字串與缺值回傳 None
+    if not isinstance(label, str) or not label.strip():
+        return None
+    return label.strip()
+
+
+def normalize(labels):
+    # 任意標籤欄 -> 標準類別 (+ 自訂標籤) 的 Categorical；每個不同的原始標籤只解析一次
+    import numpy as np
+    import pandas as pd
+    s = pd.Series(labels)
+    if _is_normalized(s.dtype):
+        return s
+    raw_codes, uniques = pd.factorize(s)
+    extras = []
+    lookup = []
+    for u in uniques:
+        note, custom = canonical(u), _custom(u)
+        if note is None and custom is not None:
+            if custom not in extras:
+                extras.append(custom)
+            lookup.append(len(NOTE_LABELS) + extras.index(custom))
+        else:
+            lookup.append(code(u))
+    lookup = np.array(lookup + [UNKNOWN], dtype=np.int32)
+    codes = lookup[raw_codes]  # factorize 的 -1 (缺值) 正好取到最後的 UNKNOWN
+    dtype = pd.CategoricalDtype(NOTE_LABELS + extras) if extras else note_dtype()
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype), index=s.index, name=s.name)
+
+
+def codes(labels):
+    return normalize(labels).cat.codes.to_numpy()
+
+
+def mask(labels, note):
+    # note 為 None 表示全部
+    if note is None:
+        import numpy as np
+        return np.ones(len(labels), dtype=bool)
+    if canonical(note) is None and _custom(note) is not None:
+        return (normalize(labels) == _custom(note)).to_numpy()
+    return codes(labels) == code(note)
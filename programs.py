@@ -0,0 +1,90 @@
+import math
+from datetime import date, datetime
+
+import notes
+
+# --- 訓練計畫 ---
+# 計畫 = 音符 + BPM 階梯 (起點 / 終點 / 每階幾 BPM) + 每階小節數 + Ghost，每天練一次、連續 days 天
+# compile_program 先把整份階梯展開成 [BPM, 細分, Ghost, 小節數]，一次交給節拍器引擎：
+# 換階在瀏覽器裡的小節線上進行，整份計畫播放期間不必 rerun
+# 每階的長度由 BPM 與小節數決定，伺服器只看練習日誌的開始/停止時間就知道完成了哪幾階，存檔時一次批次寫入
+BEATS_PER_BAR = 4
+EPSILON = 1e-3  # 時長是 epoch 秒相減，留 1 ms 的浮點誤差
+PROGRAMS = {
+    "快嘴爬坡 80→110": {"note": "1/16", "start": 80, "end": 110, "step": 2, "bars": 16, "ghost": True, "days": 28},
+    "三連音穩定 76→100": {"note": "1/3", "start": 76, "end": 100, "step": 4, "bars": 16, "ghost": True, "days": 21},
+    "八分暖身 70→100": {"note": "1/8", "start": 70, "end": 100, "step": 5, "bars": 8, "ghost": False, "days": 14},
+}
+
+
+def compile_program(program):
+    # 回傳每一階 [BPM, 細分, Ghost, 小節數]；階梯走不到終點時最後補一階終點 BPM
+    start, end = int(program["start"]), int(program["end"])
+    step = abs(int(program["step"])) or 1
+    bpms = list(range(start, end + 1, step) if end >= start else range(start, end - 1, -step))
+    if bpms[-1] != end:
+        bpms.append(end)
+    subdivisions = notes.multiplier(program["note"])
+    return [[bpm, subdivisions, bool(program["ghost"]), int(program["bars"])] for bpm in bpms]
+
+
+def step_seconds(step):
+    bpm, _, _, bars = step
+    return bars * BEATS_PER_BAR * 60.0 / bpm
+
+
+def step_bounds(steps):
+    # 每一階從開始算起的 (起點秒數, 終點秒數)
+    bounds, t = [], 0.0
+    for step in steps:
+        bounds.append((t, t + step_seconds(step)))
+        t += step_seconds(step)
+    return bounds
+
+
+def total_seconds(steps):
+    return sum(step_seconds(step) for step in steps)
+
+
+def current_step(steps, elapsed):
+    # 播放到第幾階 (0 起算)；整份播完回傳 None
+    for i, (_, end) in enumerate(step_bounds(steps)):
+        if elapsed + EPSILON < end:
+            return i
+    return None
+
+
+def completed_steps(steps, elapsed):
+    # 完整播完的階 (索引)；停在一半的那階不算
+    return [i for i, (_, end) in enumerate(step_bounds(steps)) if end <= elapsed + EPSILON]
+
+
+def step_entries(steps, note, started, elapsed, focus):
+    # 每個完成的階一筆練習記錄，時間記在該階結束的時刻；started 是練習日誌的開始時間 (epoch 秒)
+    bounds = step_bounds(steps)
+    entries = []
+    for i in completed_steps(steps, elapsed):
+        bpm, subdivisions = steps[i][0], steps[i][1]
+        begin, end = bounds[i]
+        entries.append({
+            'Date': datetime.fromtimestamp(started + end),
+            'BPM': bpm,
+            'Note_Type': note,
+            'SPS': bpm * subdivisions / 60,
+            'Duration': round((end - begin) / 60, 2),
+            'Focus': focus,
+        })
+    return entries
+
+
+def program_day(started_on, days, today=None):
+    # 計畫的第幾天 (1 起算)；超過天數回傳 None
+    today = today or date.today()
+    day = (today - date.fromisoformat(started_on)).days + 1
+    return day if 1 <= day <= days else None
+
+
+def describe(program):
+    steps = compile_program(program)
+    return (f"{len(steps)} 階 · {steps[0][0]}→{steps[-1][0]} BPM · 每階 {program['bars']} 小節"
+            f" · 約 {math.ceil(total_seconds(steps) / 60)} 分鐘 · {program['days']} 天")
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import telemetry
+from locking import FileLock
+from storage import COLUMNS, clean_history, row_keys
+
+# --- 本地優先 + 背景對帳 ---
+# 讀取一律走本地 (快照 + 日誌)，GitHub 不在載入的路徑上；
+# 同步執行緒每輪上傳完佇列後呼叫 run_once：
+#   遠端有、本地沒有的記錄 -> 追加進本地日誌
+#   本地有、遠端沒有 (也不在上傳佇列) 的記錄 -> 排進上傳佇列
+# 記錄 ID = 時間 (ns) + 音符 + 時長 的雜湊 (storage.row_keys)。同一個 ID 兩邊內容不同時
+# 取 (BPM, SPS, Focus) 較大的版本：結果與哪一邊先對帳無關，兩台裝置各自合併會得到同一份
+# 對帳只做聯集，不處理刪除；只有內容衝突時才整份覆寫 (本地 rewrite + 遠端 push_full)
+
+
+def record_ids(df):
+    if df.empty:
+        return np.zeros(0, dtype=np.uint64)
+    return row_keys(df).to_numpy()
+
+
+def _content(df):
+    # 比較同一 ID 的內容：統一型別，CSV / Arrow 讀出的同一筆記錄才會相等
+    return pd.DataFrame({
+        'BPM': pd.to_numeric(df['BPM']).astype('float64').round(3).to_numpy(),
+        'SPS': pd.to_numeric(df['SPS']).astype('float64').round(6).to_numpy(),
+        'Focus': df['Focus'].fillna("").astype(str).to_numpy(),
+    })
+
+
+def merge_histories(local, remote):
+    # 回傳 (本地缺的, 遠端缺的, 合併結果)；合併結果只在有內容衝突時才算，否則是 None
+    lid, rid = record_ids(local), record_ids(remote)
+    in_remote, in_local = np.isin(lid, rid), np.isin(rid, lid)
+    # 遠端分片是至少一次上傳，可能有重複的行；同一 ID 只拉一筆下來
+    new_remote = ~in_local
+    new_remote[new_remote] = ~pd.Series(rid[new_remote]).duplicated().to_numpy()
+    to_local, to_remote = remote[new_remote], local[~in_remote]
+    if not in_remote.any():
+        return to_local, to_remote, None
+    left = _content(local[in_remote]).assign(_id=lid[in_remote]).drop_duplicates('_id').set_index('_id')
+    right = _content(remote[in_local]).assign(_id=rid[in_local]).drop_duplicates('_id').set_index('_id')
+    if left.sort_index().equals(right.sort_index()):
+        return to_local, to_remote, None
+    both = pd.concat([local, remote], ignore_index=True)
+    keys = _content(both).assign(_id=np.concatenate([lid, rid]))
+    order = keys.sort_values(['_id', 'BPM', 'SPS', 'Focus'], kind='stable').index
+    winners = keys.loc[order].drop_duplicates('_id', keep='last').index
+    merged = both.loc[winners].sort_values('Date', kind='stable', ignore_index=True)
+    return to_local, to_remote, merged
+
+
+class Reconciler:
+    def __init__(self, cache, sync):
+        # cache：全欄位的 HistoryCache (與 app 共用)；sync：GithubSync
+        self.cache = cache
+        self.log = cache.log
+        self.sync = sync
+        base, _ = os.path.splitext(self.log.data_file)
+        # 多個程序共用同一份記錄時只讓一個對帳，避免同一批遠端記錄被追加兩次
+        self._lock = FileLock(f"{base}.reconcile.lock")
+        self._checked = None
+        self.last_result = None
+
+    @telemetry.timed("reconcile.run_once")
+    def run_once(self):
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            remote = self.sync.load_remote()
+            local = self.cache.load()
+            # 兩邊都沒變就不必再比一次
+            version = (id(local), len(local), self.sync.remote_version(), len(self.sync.queue))
+            if version == self._checked:
+                return self.last_result
+            to_local, to_remote, merged = merge_histories(local, remote)
+            pending = self.sync.queue.peek()
+            if pending and not to_remote.empty:
+                to_remote = to_remote[~np.isin(record_ids(to_remote), record_ids(clean_history(pd.DataFrame(pending))))]
+            if merged is not None:
+                # 內容衝突 (少見)：兩邊都換成同一份合併結果
+                self.log.rewrite(merged, base=local)
+                self.sync.push_full(merged, base=remote)
+            else:
+                if not to_local.empty:
+                    self.log.append_frame(to_local.sort_values('Date', kind='stable'))
+                if not to_remote.empty:
+                    self.sync.enqueue_many(to_remote[COLUMNS].to_dict('records'))
+            changed = merged is not None or not to_local.empty or not to_remote.empty
+            self._checked = None if changed else version
+            self.last_result = {"to_local": len(to_local), "to_remote": len(to_remote), "conflicts": merged is not None}
+            telemetry.count("reconcile.pulled_rows", len(to_local))
+            telemetry.count("reconcile.pushed_rows", len(to_remote))
+            telemetry.count("reconcile.conflicts", int(merged is not None))
+            return self.last_result
+        finally:
+            self._lock.release()
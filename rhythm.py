@@ -0,0 +1,192 @@
+import multiprocessing
+import os
+import sys
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import notes
+
+# --- 練習錄音的節奏分析 ---
+# WAV 切成固定長度的區塊，各區塊在子程序裡獨立處理 (前後多讀一段重疊，區塊邊界的起音不會漏掉或重複)，
+# 記憶體只跟區塊大小 x 程序數有關，跟錄音長度無關；子程序只載入 numpy，pandas 等存檔時才載入
+# 起音偵測：短時頻譜的 log 幅度做正向差分 (spectral flux)，再以局部平均 + 標準差當門檻挑峰值
+# 評分：依 BPM x 音符倍數得到格線間隔，每 16 格用圓形平均估一次對齊 (容許慢慢飄)，
+# 起音落在格線 ± 容許誤差內算命中；準確度 = 命中數 / max(起音數, 應有的音數)
+CHUNK_SECONDS = 10.0
+POOL_MIN_CHUNKS = 24     # 短錄音在目前程序處理就好，開子程序的成本比分析還高
+MARGIN_SECONDS = 0.6     # 區塊前後多讀的長度，要大於門檻視窗的一半
+HOP_SECONDS = 0.005
+THRESHOLD_SECONDS = 0.5  # 局部門檻的視窗
+PEAK_SECONDS = 0.03      # 兩個起音至少相隔
+THRESHOLD_K = 1.5
+SILENCE_DB = -50.0
+ALIGN_WINDOW = 16        # 每幾個格線間隔重新估一次對齊
+MAX_TOLERANCE = 0.05     # 命中容許誤差上限 (秒)；格線很密時改用間隔的 1/4
+RESULT_COLUMNS = ['Record', 'Date', 'Note_Type', 'BPM', 'Accuracy', 'Hit_Rate', 'Coverage', 'Mean_Error_ms',
+                  'Mean_Abs_Error_ms', 'Onsets', 'Expected', 'Analyzed']
+
+
+class RecordingError(ValueError):
+    pass
+
+
+# --- 讀取 WAV ---
+def wav_info(path):
+    try:
+        with wave.open(path, "rb") as w:
+            if w.getsampwidth() not in (1, 2, 3, 4):
+                raise RecordingError(f"unsupported sample width: {w.getsampwidth()}")
+            return w.getframerate(), w.getnframes()
+    except (wave.Error, EOFError) as e:
+        raise RecordingError(str(e)) from e
+
+
+def read_frames(path, start, count):
+    # 讀 [start, start + count) 的樣本，轉成 -1 ~ 1 的單聲道 float32
+    with wave.open(path, "rb") as w:
+        channels, width = w.getnchannels(), w.getsampwidth()
+        start = max(start, 0)
+        w.setpos(min(start, w.getnframes()))
+        raw = w.readframes(count)
+    if width == 3:
+        # 24-bit：補成 32-bit 再轉
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        data = (b[:, 0].astype(np.int32) << 8 | b[:, 1].astype(np.int32) << 16 | b[:, 2].astype(np.int32) << 24)
+        scale = 2.0 ** 31
+    elif width == 1:
+        data = np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128
+        scale = 128.0
+    else:
+        data = np.frombuffer(raw, dtype={2: '<i2', 4: '<i4'}[width])
+        scale = float(2 ** (8 * width - 1))
+    return (data.reshape(-1, channels).mean(axis=1) / scale).astype(np.float32)
+
+
+# --- 起音偵測 ---
+def onset_strength(samples, sr):
+    # 回傳 (每個分析窗的 spectral flux, 每個窗的能量 dB, hop 樣本數)
+    hop = max(int(sr * HOP_SECONDS), 16)
+    size = 4 * hop
+    if len(samples) < size + hop:
+        return np.zeros(0), np.zeros(0), hop
+    frames = np.lib.stride_tricks.sliding_window_view(samples, size)[::hop]
+    spectrum = np.log1p(100 * np.abs(np.fft.rfft(frames * np.hanning(size).astype(np.float32), axis=1)))
+    flux = np.maximum(np.diff(spectrum, axis=0), 0).sum(axis=1)
+    energy = 10 * np.log10(np.mean(frames[1:] ** 2, axis=1) + 1e-12)
+    return flux, energy, hop
+
+
+def _moving(values, radius):
+    # 置中的移動平均 (邊界用實際樣本數)
+    c = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    idx = np.arange(len(values))
+    lo, hi = np.maximum(idx - radius, 0), np.minimum(idx + radius + 1, len(values))
+    return (c[hi] - c[lo]) / (hi - lo)
+
+
+def pick_onsets(flux, energy, hop, sr):
+    # 回傳起音所在的分析窗索引
+    if len(flux) == 0:
+        return np.zeros(0, dtype=np.int64)
+    radius = max(int(THRESHOLD_SECONDS / 2 / HOP_SECONDS), 1)
+    mean = _moving(flux, radius)
+    std = np.sqrt(np.maximum(_moving(flux ** 2, radius) - mean ** 2, 0))
+    peak = max(int(PEAK_SECONDS * sr / hop), 1)
+    local_max = np.lib.stride_tricks.sliding_window_view(np.pad(flux, peak, constant_values=-np.inf), 2 * peak + 1).max(axis=1)
+    return np.flatnonzero((flux >= local_max) & (flux > mean + THRESHOLD_K * std) & (energy > SILENCE_DB))
+
+
+def detect_chunk(path, start, count):
+    # 子程序的工作：回傳落在 [start, start + count) 的起音時間 (秒)
+    sr, _ = wav_info(path)
+    margin = int(MARGIN_SECONDS * sr)
+    begin = max(start - margin, 0)
+    samples = read_frames(path, begin, count + (start - begin) + margin)
+    flux, energy, hop = onset_strength(samples, sr)
+    # flux[i] 是第 i 與 i+1 個分析窗的差：起音算在第 i+1 個窗的中間
+    positions = begin + (pick_onsets(flux, energy, hop, sr) + 1) * hop + 2 * hop
+    positions = positions[(positions >= start) & (positions < start + count)]
+    return positions / sr
+
+
+def detect_onsets(path, workers=None, chunk_seconds=CHUNK_SECONDS):
+    # workers=1 在目前程序裡逐塊處理；None = 區塊夠多時依 CPU 數開子程序
+    sr, total = wav_info(path)
+    step = int(chunk_seconds * sr)
+    starts = list(range(0, total, step))
+    if workers is None:
+        workers = min(len(starts), os.cpu_count() or 1) if len(starts) >= POOL_MIN_CHUNKS else 1
+    if workers <= 1 or len(starts) <= 1:
+        parts = [detect_chunk(path, s, step) for s in starts]
+    else:
+        # spawn：Streamlit 的執行緒裡 fork 不安全
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            parts = list(pool.map(detect_chunk, [path] * len(starts), starts, [step] * len(starts)))
+    return (np.concatenate(parts) if parts else np.zeros(0)), total / sr
+
+
+# --- 評分 ---
+def score(onsets, bpm, multiplier):
+    interval = 60.0 / (float(bpm) * multiplier)
+    if len(onsets) < 2:
+        return {"Accuracy": 0.0, "Hit_Rate": 0.0, "Coverage": 0.0, "Mean_Error_ms": float("nan"),
+                "Mean_Abs_Error_ms": float("nan"), "Onsets": int(len(onsets)), "Expected": 0}
+    tolerance = min(MAX_TOLERANCE, interval / 4)
+    phase = 2 * np.pi * onsets / interval
+    group = ((onsets - onsets[0]) // (interval * ALIGN_WINDOW)).astype(np.int64)
+    offset = np.arctan2(np.bincount(group, np.sin(phase)), np.bincount(group, np.cos(phase)))[group]
+    error = np.angle(np.exp(1j * (phase - offset))) / (2 * np.pi) * interval  # 到最近格線的秒數 (有正負)
+    hits = int((np.abs(error) <= tolerance).sum())
+    expected = int(round((onsets[-1] - onsets[0]) / interval)) + 1
+    return {
+        "Accuracy": hits / max(len(onsets), expected),
+        "Hit_Rate": hits / len(onsets),
+        "Coverage": min(hits / expected, 1.0),
+        "Mean_Error_ms": float(error.mean() * 1000),
+        "Mean_Abs_Error_ms": float(np.abs(error).mean() * 1000),
+        "Onsets": int(len(onsets)),
+        "Expected": expected,
+    }
+
+
+def analyze(path, bpm, note, workers=None):
+    onsets, duration = detect_onsets(path, workers)
+    result = score(onsets, bpm, notes.multiplier(note))
+    result["Duration_s"] = duration
+    return result
+
+
+# --- 結果存檔 (記錄旁的 sidecar) ---
+# 以記錄 ID (storage.row_keys：時間 + 音符 + 時長) 對應練習記錄，只追加；同一筆重分析時以最後一次為準
+def save_result(path, session, result):
+    # session：歷史中的一列 (Series)
+    import pandas as pd
+    from locking import FileLock
+    from storage import row_keys
+    record = int(row_keys(session.to_frame().T).iloc[0])
+    row = {'Record': str(record), 'Date': session['Date'], 'Note_Type': session['Note_Type'], 'BPM': session['BPM'],
+           'Analyzed': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **{k: result[k] for k in RESULT_COLUMNS if k in result}}
+    frame = pd.DataFrame([row], columns=RESULT_COLUMNS)
+    with FileLock(path + ".lock"):
+        header = not os.path.exists(path) or os.path.getsize(path) == 0
+        frame.to_csv(path, mode="a", header=header, index=False, lineterminator="\n")
+    return row
+
+
+def load_results(path):
+    import pandas as pd
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    df = pd.read_csv(path, dtype={'Record': str})
+    return df.drop_duplicates('Record', keep='last').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    # python rhythm.py take.wav 90 1/16
+    if len(sys.argv) < 4:
+        print("usage: python rhythm.py <recording.wav> <bpm> <note>")
+        sys.exit(1)
+    print(analyze(sys.argv[1], float(sys.argv[2]), sys.argv[3]))
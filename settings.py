@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+
+# --- 上次設定 ---
+# 節拍器頁只讀這份小檔 (BPM / 音符 / Ghost)，不必為了上次的 BPM 載入整份歷史
+DEFAULT_SETTINGS = {"bpm": 85, "note": "1/16", "ghost": False}
+
+
+def settings_path(data_file):
+    base, _ = os.path.splitext(data_file)
+    return f"{base}.settings.json"
+
+
+def load_settings(path):
+    # 檔案不存在或壞掉時回傳 None，由呼叫端決定退回什麼
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {**DEFAULT_SETTINGS, **json.load(f)}
+    except (OSError, ValueError):
+        return None
+
+
+def save_settings(path, **values):
+    settings = {**(load_settings(path) or DEFAULT_SETTINGS), **values}
+    # 暫存檔名每次不同：兩個程序同時存檔不會寫進同一個暫存檔
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return settings
+
+
+# 設定存放的介面 (load / save)；SQLite 後端的 sqlite_store.SqliteSettings 提供同樣的方法
+class FileSettings:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        return load_settings(self.path)
+
+    def save(self, **values):
+        return save_settings(self.path, **values)
@@ -0,0 +1,237 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import telemetry
+
+# --- SQLite 後端 (WAL) ---
+# 同一台機器上的多個 app 程序 (負載平衡後面的多個 Streamlit worker) 共用一個資料庫檔：
+#   WAL：讀取不擋寫入；寫入一律 BEGIN IMMEDIATE 排隊，busy_timeout 內自動等候
+#   讀取包在交易裡，同一次載入的幾個查詢看到同一個版本 (一致性讀取)
+#   sessions 只追加、id 遞增：快取只讀上次之後的 id；整份覆寫時 generation + 1，各程序看到就整份重讀
+# 每個程序每個檔案一個連線池，連線可跨執行緒，但同一時間只借給一個執行緒
+# WAL 需要共用記憶體，資料庫檔不能放在網路磁碟；跨機器部署要換伺服器型的後端 (提供同樣的方法即可)
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    Date INTEGER NOT NULL,
+    BPM REAL,
+    Note_Type TEXT,
+    SPS REAL,
+    Duration REAL,
+    Focus TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (Date);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+"""
+# Date 存 ns (整數)，排序與比對都不必解析字串
+_COLUMNS = ['Date', 'BPM', 'Note_Type', 'SPS', 'Duration', 'Focus']
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        with self.write() as conn:
+            for statement in filter(str.strip, _SCHEMA.split(";")):
+                conn.execute(statement)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # 借不到連線 (同時用的執行緒超過 size) 就等
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._idle.put(conn)
+
+    @contextmanager
+    def read(self):
+        # 交易內的所有查詢看到同一個快照
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            yield conn
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def write(self):
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+
+
+@lru_cache(maxsize=None)
+def _pool(path):
+    return ConnectionPool(path)
+
+
+def connection_pool(path):
+    # 同一個程序裡同一個檔案共用一個池
+    return _pool(os.path.abspath(path))
+
+
+def _generation(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _rows(df):
+    import pandas as pd
+    dates = pd.to_datetime(df['Date'], format='ISO8601').astype('datetime64[ns]').astype('int64')
+    values = [dates.tolist()] + [df[col].tolist() if col in df.columns else [None] * len(df) for col in _COLUMNS[1:]]
+    values[2] = [None if n is None or n != n else str(n) for n in values[2]]  # Categorical / NaN -> 文字
+    return list(zip(*values))
+
+
+def _insert(conn, rows):
+    conn.executemany('INSERT INTO sessions (Date, BPM, Note_Type, SPS, Duration, Focus) VALUES (?, ?, ?, ?, ?, ?)',
+                     rows)
+
+
+def _select(conn, columns, after_id=0):
+    # 回傳 (DataFrame, 最大 id)
+    import pandas as pd
+    from storage import clean_history
+    columns = [c for c in columns if c in _COLUMNS]
+    cursor = conn.execute(f"SELECT id, {', '.join(columns)} FROM sessions WHERE id > ? ORDER BY id", (after_id,))
+    df = pd.DataFrame(cursor.fetchall(), columns=['id'] + columns)
+    last_id = int(df['id'].iloc[-1]) if not df.empty else after_id
+    if 'Date' in columns:
+        df['Date'] = pd.to_datetime(df['Date'], unit='ns')
+    return clean_history(df.drop(columns='id'), columns).reset_index(drop=True), last_id
+
+
+# 介面與 storage.SessionLog 相同 (data_file / read / append / append_frame / rewrite / compact)
+class SqliteLog:
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.pool = connection_pool(data_file)
+        self._migrate()
+
+    def _migrate(self):
+        # 第一次開啟：把同資料夾的檔案記錄 (Arrow / v8 / v5 / v3 + 日誌) 搬進來，只做一次
+        with self.pool.write() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                return
+            from storage import SessionLog
+            folder = os.path.dirname(self.data_file)
+            arrow = os.path.join(folder, "rap_log_v8.arrow")
+            legacy = SessionLog(arrow if os.path.exists(arrow) else os.path.join(folder, "rap_log_v8.csv")).read()
+            if not legacy.empty:
+                _insert(conn, _rows(legacy))
+            conn.execute("INSERT INTO meta VALUES ('migrated', ?)", (str(len(legacy)),))
+
+    # --- 讀取 ---
+    @telemetry.timed("sqlite.read")
+    def read(self, columns=_COLUMNS):
+        with self.pool.read() as conn:
+            return _select(conn, columns)[0]
+
+    # --- 寫入 ---
+    @telemetry.timed("sqlite.append")
+    def append(self, entry):
+        import pandas as pd
+        self.append_frame(pd.DataFrame([entry]))
+
+    @telemetry.timed("sqlite.append_frame")
+    def append_frame(self, df):
+        rows = _rows(df)
+        with self.pool.write() as conn:
+            _insert(conn, rows)
+
+    @telemetry.timed("sqlite.rewrite")
+    def rewrite(self, df, base=None):
+        # 整份覆寫；base 的意義與 SessionLog.rewrite 相同 (期間別的程序新存的記錄會合併進來)
+        from storage import merge_new_rows
+        with self.pool.write() as conn:
+            if base is not None:
+                df = merge_new_rows(df, base, _select(conn, _COLUMNS)[0])
+            conn.execute("DELETE FROM sessions")
+            _insert(conn, _rows(df))
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(_generation(conn) + 1),))
+        return df
+
+    def compact(self):
+        # 把 WAL 併回主檔 (讀取端不受影響)
+        with self.pool.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+# 介面與 storage.HistoryCache 相同 (log / load / index / invalidate)
+class SqliteHistoryCache:
+    def __init__(self, log, columns=_COLUMNS):
+        self.log = log
+        self.columns = list(columns)
+        self.df = None
+        self.index = None
+        self._lock = threading.Lock()
+        self._generation = None
+        self._last_id = 0
+
+    def invalidate(self):
+        with self._lock:
+            self.df = None
+            self.index = None
+
+    @telemetry.timed("sqlite.cache_load")
+    def load(self):
+        from aggregates import HistoryIndex
+        from storage import concat_history
+        with self._lock, self.log.pool.read() as conn:
+            generation = _generation(conn)
+            if self.df is None or generation != self._generation:
+                self.df, self._last_id = _select(conn, self.columns)
+                self.index = HistoryIndex.from_frame(self.df)
+                self._generation = generation
+                return self.df
+            new_rows, self._last_id = _select(conn, self.columns, self._last_id)
+            if not new_rows.empty:
+                self.index.add_frame(new_rows)
+                self.df = new_rows if self.df.empty else concat_history([self.df, new_rows])
+            return self.df
+
+
+# 介面與 settings.FileSettings 相同 (load / save)；沒有設定時沿用舊的 JSON 設定檔
+class SqliteSettings:
+    def __init__(self, data_file, legacy=None):
+        self.pool = connection_pool(data_file)
+        self.legacy = legacy
+
+    def load(self):
+        from settings import DEFAULT_SETTINGS
+        with self.pool.read() as conn:
+            rows = conn.execute("SELECT key, value FROM settings").fetchall()
+        if not rows:
+            return self.legacy.load() if self.legacy is not None else None
+        return {**DEFAULT_SETTINGS, **{key: json.loads(value) for key, value in rows}}
+
+    def save(self, **values):
+        # 與 settings.save_settings 相同：沒給的欄位沿用目前的設定 (第一次存時是舊的 JSON 設定檔)
+        from settings import DEFAULT_SETTINGS
+        settings = {**(self.load() or DEFAULT_SETTINGS), **values}
+        with self.pool.write() as conn:
+            conn.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                             [(key, json.dumps(value)) for key, value in settings.items()])
+        return settings
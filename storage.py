@@ -0,0 +1,363 @@
+import csv
+import io
+import os
+import sys
+import threading
+
+import pandas as pd
+
+import notes
+import telemetry
+from aggregates import HistoryIndex
+from locking import FileLock
+
+# --- 資料格式 ---
+# v3 / v5 / v8 的 CSV 欄位相同，差別只在 Note_Type 文字與 Duration 精度
+# Note_Type 讀入時統一成標準標籤 (notes.py)，之後寫回的檔案也都是標準標籤；登錄表以外的自訂標籤原樣保留
+COLUMNS = ['Date', 'BPM', 'Note_Type', 'SPS', 'Duration', 'Focus']
+NUMERIC_COLUMNS = ['Duration', 'BPM', 'SPS']
+LEGACY_FILES = ["rap_log_v8.csv", "rap_log_v5.csv", "rap_log_v3.csv"]
+ARROW_EXT = ".arrow"
+
+
+def empty_history(columns=COLUMNS):
+    return pd.DataFrame(columns=columns)
+
+
+def concat_history(frames):
+    # 兩邊的自訂標籤不同時 concat 會把 Note_Type 退成 object，重新編成同一組類別
+    df = pd.concat(frames, ignore_index=True)
+    if 'Note_Type' in df.columns:
+        df['Note_Type'] = notes.normalize(df['Note_Type'])
+    return df
+
+
+def clean_history(df, columns=COLUMNS):
+    # 補齊舊版缺少的欄位
+    for col in columns:
+        if col not in df.columns:
+            df[col] = None
+    df = df[list(columns)]
+    if df.empty:
+        return df
+    # ISO8601：同一欄混有含/不含微秒的時間也能解析
+    if 'Date' in columns:
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce', format='ISO8601')
+        df = df.dropna(subset=['Date'])
+    for col in NUMERIC_COLUMNS:
+        if col in columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    if 'Note_Type' in columns:
+        df['Note_Type'] = notes.normalize(df['Note_Type'])
+    return df
+
+
+# --- 欄式快照 (Arrow IPC) ---
+# 時間存 timestamp、數值存 float32、Note_Type 存字典編碼，讀取時不必再轉型
+def arrow_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('Date', pa.timestamp('us')),
+        ('BPM', pa.float32()),
+        ('Note_Type', pa.dictionary(pa.int8(), pa.string())),
+        ('SPS', pa.float32()),
+        ('Duration', pa.float32()),
+        ('Focus', pa.string()),
+    ])
+
+
+def read_arrow(path, columns=None):
+    import pyarrow as pa
+    # memory map：沒選到的欄位完全不會被讀進記憶體
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(list(columns))
+        df = table.to_pandas()
+    # 字典內容可能是舊標籤，換成登錄表的固定類別 (只處理不同的字典值)
+    if 'Note_Type' in df.columns:
+        df['Note_Type'] = notes.normalize(df['Note_Type'])
+    return df
+
+
+def write_arrow(df, path):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df[COLUMNS], schema=arrow_schema(), preserve_index=False, safe=False)
+    # IPC 檔每個欄位只能有一份字典
+    table = table.unify_dictionaries().combine_chunks()
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def row_keys(df):
+    # 比對用的記錄指紋：時間 (統一成 ns) + 音符 + 時長，不受欄位子集或 float32/64 影響
+    keys = pd.DataFrame({
+        'Date': pd.to_datetime(df['Date']).astype('datetime64[ns]'),
+        'Note_Type': df['Note_Type'].astype(str),
+        'Duration': pd.to_numeric(df['Duration']).astype('float64').round(2),
+    })
+    return pd.util.hash_pandas_object(keys, index=False)
+
+
+def merge_new_rows(df, base, current):
+    # 合併衝突：current (磁碟上最新) 裡有、但呼叫端當初讀到的 base 沒有的記錄，
+    # 是別的 session 在這段期間存的，補回 df，不讓最後寫入的人蓋掉
+    if not base.empty and not current.empty:
+        current = current[~row_keys(current).isin(row_keys(base)).values]
+    if current.empty:
+        return df
+    return pd.concat([df, current[df.columns]], ignore_index=True).sort_values('Date', kind='stable', ignore_index=True)
+
+
+def migrate_to_arrow(csv_files, arrow_file):
+    # 一次性搬移：把舊 CSV (v3/v5/v8 與未合併的日誌) 合成一份 Arrow 快照
+    # 日誌已併進快照，寫完就刪掉，否則改讀 Arrow 後日誌的記錄會算兩次；整段持有寫入鎖，期間的存檔不會遺失
+    base, _ = os.path.splitext(arrow_file)
+    with FileLock(f"{base}.lock"):
+        # v3 / v5 / v8 可能互相包含 (新版是舊版複製過來的)：後面的檔案只取前面沒有的記錄 (依 row_keys)
+        # 同一個檔案裡內容相同的兩筆是兩次練習，照樣保留
+        frames, seen = [], None
+        for path in csv_files:
+            if not os.path.exists(path):
+                continue
+            df = clean_history(pd.read_csv(path))
+            if df.empty:
+                continue
+            keys = row_keys(df)
+            if seen is not None:
+                df = df[~keys.isin(seen).to_numpy()]
+            seen = keys if seen is None else pd.concat([seen, keys], ignore_index=True)
+            frames.append(df)
+        df = concat_history(frames) if frames else empty_history()
+        df = df.sort_values('Date', kind='stable', ignore_index=True)
+        write_arrow(df, arrow_file)
+        for path in csv_files:
+            if path.endswith(".journal.csv") and os.path.exists(path):
+                os.remove(path)
+    return len(df)
+
+
+# 快照 (CSV 或 Arrow) + 追加日誌：存檔只寫一行，累積到一定筆數再於背景合併回快照
+# 多個程序共用同一份記錄時：
+#   .lock          追加、日誌換名、整份覆寫互斥 (追加只持有寫一行的時間)
+#   .compact.lock  同一時間只有一個程序在合併/覆寫快照
+# 快照一律寫暫存檔再 os.replace，讀取端不會看到寫一半的檔案
+class SessionLog:
+    def __init__(self, data_file, compact_every=500):
+        self.data_file = data_file
+        self.is_arrow = data_file.endswith(ARROW_EXT)
+        base, _ = os.path.splitext(data_file)
+        # 日誌一律是 CSV，方便逐行追加
+        self.journal_file = f"{base}.journal.csv"
+        self.compacting_file = f"{base}.compacting.csv"
+        self.compact_every = compact_every
+        self._write_lock = FileLock(f"{base}.lock")
+        self._compact_lock = FileLock(f"{base}.compact.lock")
+        self._pending = self._count_rows(self.journal_file)
+
+    # --- 讀取 ---
+    @telemetry.timed("storage.read")
+    def read(self, columns=COLUMNS):
+        df = self.read_base(columns)
+        if os.path.exists(self.journal_file):
+            journal = self._read_csv(self.journal_file, columns)
+            if not journal.empty:
+                df = journal if df.empty else concat_history([df, journal])
+        # 合併進行中 (任一程序) 或中途當機時，compacting 檔的資料可能已寫進快照
+        if os.path.exists(self.compacting_file):
+            df = df.drop_duplicates(ignore_index=True)
+        return df
+
+    @telemetry.timed("storage.read_base")
+    def read_base(self, columns=COLUMNS):
+        # 快照 + 合併中的日誌 (不含目前的日誌)
+        df = self._read_snapshot(columns)
+        if os.path.exists(self.compacting_file):
+            pending = self._read_csv(self.compacting_file, columns)
+            if not pending.empty:
+                df = pending if df.empty else concat_history([df, pending])
+        return df
+
+    def snapshot_path(self):
+        if os.path.exists(self.data_file):
+            return self.data_file
+        # 沒有 v8 快照時，沿用最新的舊版記錄
+        folder = os.path.dirname(self.data_file)
+        for name in LEGACY_FILES:
+            path = os.path.join(folder, name)
+            if path != self.data_file and os.path.exists(path):
+                return path
+        return None
+
+    def _read_snapshot(self, columns=COLUMNS):
+        path = self.snapshot_path()
+        if path is None:
+            return empty_history(columns)
+        if path.endswith(ARROW_EXT):
+            return read_arrow(path, columns)
+        return self._read_csv(path, columns)
+
+    def _read_csv(self, path, columns=COLUMNS):
+        try:
+            df = pd.read_csv(path, usecols=lambda c: c in columns)
+        except (pd.errors.EmptyDataError, pd.errors.ParserError, OSError):
+            return empty_history(columns)
+        return clean_history(df, columns)
+
+    def _count_rows(self, path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as f:
+            return max(sum(1 for _ in f) - 1, 0)
+
+    # --- 寫入 ---
+    @telemetry.timed("storage.append")
+    def append(self, entry):
+        row = [entry.get(col, "") for col in COLUMNS]
+        with self._write_lock, open(self.journal_file, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(COLUMNS)
+            writer.writerow(row)
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending += 1
+        if self._pending >= self.compact_every:
+            self.compact_in_background()
+
+    @telemetry.timed("storage.append_frame")
+    def append_frame(self, df):
+        # 批次追加 (匯入用)：整塊在一次持鎖內寫完
+        with self._write_lock, open(self.journal_file, "a", newline="", encoding="utf-8") as f:
+            if f.tell() == 0:
+                csv.writer(f).writerow(COLUMNS)
+            df.to_csv(f, index=False, header=False, columns=COLUMNS, lineterminator="\r\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending += len(df)
+        if self._pending >= self.compact_every:
+            self.compact_in_background()
+
+    @telemetry.timed("storage.rewrite")
+    def rewrite(self, df, base=None):
+        # 完整覆寫 (匯入/修正用)，日誌內容已包含在 df 中
+        # base：呼叫端修改前讀到的歷史；有給的話，期間別人新存的記錄會合併進來而不是被蓋掉
+        with self._compact_lock, self._write_lock:
+            if base is not None:
+                df = merge_new_rows(df, base, self.read())
+            self._write_snapshot(df)
+            for path in (self.journal_file, self.compacting_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._pending = 0
+        return df
+
+    # --- 合併 ---
+    def compact_in_background(self):
+        if self._compact_lock.locked():
+            return
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    @telemetry.timed("storage.compact")
+    def compact(self):
+        with self._compact_lock:
+            # 上次合併中途中斷：compacting 檔可能已部分寫進快照
+            recovering = os.path.exists(self.compacting_file)
+            # 先把日誌換名，之後的存檔會寫到新的日誌，不會被這次合併吃掉
+            # 換名時持有寫入鎖：正在追加的那一行一定寫完才換
+            with self._write_lock:
+                if os.path.exists(self.journal_file) and not os.path.exists(self.compacting_file):
+                    os.replace(self.journal_file, self.compacting_file)
+                self._pending = self._count_rows(self.journal_file)
+            if not os.path.exists(self.compacting_file):
+                return
+            df = self.read_base()
+            if recovering:
+                df = df.drop_duplicates(ignore_index=True)
+            self._write_snapshot(df)
+            os.remove(self.compacting_file)
+
+    def _write_snapshot(self, df):
+        if self.is_arrow:
+            write_arrow(df, self.data_file)
+            return
+        tmp = self.data_file + ".tmp"
+        df.to_csv(tmp, index=False, columns=COLUMNS)
+        os.replace(tmp, self.data_file)
+
+
+def _file_signature(path):
+    if not path or not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+# 跨 rerun 共用的歷史快取：快照沒變就只解析日誌新增的部分
+class HistoryCache:
+    def __init__(self, log, columns=COLUMNS):
+        self.log = log
+        self.columns = list(columns)
+        self.df = None
+        self.index = None
+        self._lock = threading.Lock()
+        self._base_sig = None
+        self._journal_offset = 0
+
+    def invalidate(self):
+        with self._lock:
+            self.df = None
+            self.index = None
+            self._base_sig = None
+
+    @telemetry.timed("storage.cache_load")
+    def load(self):
+        with self._lock:
+            base_sig = (_file_signature(self.log.snapshot_path()), _file_signature(self.log.compacting_file))
+            journal_size = os.path.getsize(self.log.journal_file) if os.path.exists(self.log.journal_file) else 0
+            # 快照被合併/覆寫過，或日誌變短 (被換名)：整份重讀
+            if self.df is None or base_sig != self._base_sig or journal_size < self._journal_offset:
+                self.df = self.log.read_base(self.columns)
+                # 與 SessionLog.read 相同：合併中途中斷時 compacting 檔的資料可能已寫進快照
+                if os.path.exists(self.log.compacting_file):
+                    self.df = self.df.drop_duplicates(ignore_index=True)
+                self.index = HistoryIndex.from_frame(self.df)
+                self._base_sig = base_sig
+                self._journal_offset = 0
+            if journal_size > self._journal_offset:
+                self._read_journal_tail()
+            return self.df
+
+    @telemetry.timed("storage.journal_tail")
+    def _read_journal_tail(self):
+        with open(self.log.journal_file, "rb") as f:
+            f.seek(self._journal_offset)
+            chunk = f.read()
+        # 只處理完整的行，寫到一半的留給下次
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return
+        text = chunk[:end].decode("utf-8")
+        if self._journal_offset == 0:
+            text = text.split("\n", 1)[1]
+        self._journal_offset += end
+        if not text.strip():
+            return
+        new_rows = pd.read_csv(io.StringIO(text), header=None, names=COLUMNS)
+        new_rows = clean_history(new_rows, self.columns)
+        self.index.add_frame(new_rows)
+        if self.df.empty:
+            self.df = new_rows.reset_index(drop=True)
+        else:
+            self.df = concat_history([self.df, new_rows])
+
+if __name__ == "__main__":
+    # python storage.py rap_log_v8.arrow rap_log_v3.csv rap_log_v5.csv rap_log_v8.csv rap_log_v8.journal.csv
+    if len(sys.argv) < 3:
+        print("usage: python storage.py <out.arrow> <in.csv> [<in.csv> ...]")
+        sys.exit(1)
+    count = migrate_to_arrow(sys.argv[2:], sys.argv[1])
+    print(f"migrated {count} sessions -> {sys.argv[1]}")
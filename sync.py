@@ -0,0 +1,506 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import telemetry
+from locking import FileLock
+from storage import COLUMNS, clean_history, merge_new_rows
+
+# 沒裝 PyGithub 時仍可搭配 LocalRepo 使用
+try:
+    from github import BadCredentialsException, GithubException, RateLimitExceededException, UnknownObjectException
+except ImportError:
+    class GithubException(Exception):
+        def __init__(self, status, data=None, headers=None, message=None):
+            super().__init__(status, data)
+            self.status = status
+            self.data = data
+            self.headers = headers or {}
+
+    class BadCredentialsException(GithubException):
+        pass
+
+    class RateLimitExceededException(GithubException):
+        pass
+
+    class UnknownObjectException(GithubException):
+        pass
+
+logger = logging.getLogger(__name__)
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return str(value)
+    if hasattr(value, "item"):
+        value = value.item()
+    # 缺值 (NaN) 存成 null，寫進 CSV 時才會是空欄而不是 "nan"
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def rows_to_csv(entries, header=False):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    if header:
+        writer.writerow(COLUMNS)
+    for entry in entries:
+        writer.writerow(["" if entry.get(col) is None else entry.get(col) for col in COLUMNS])
+    return buf.getvalue()
+
+
+# --- 本地持久佇列 ---
+# 存檔先寫進這裡 (fsync)，上傳成功才移除；程式重啟後會自動補傳
+# lock 管同一程序內的執行緒，_file_lock 管其他程序：ack 重寫檔案時不會吃掉別人剛 put 的記錄
+class SyncQueue:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._file_lock = FileLock(path + ".lock")
+
+    def put(self, entry):
+        self.put_many([entry])
+
+    def put_many(self, entries):
+        # 一批只 fsync 一次
+        lines = []
+        for entry in entries:
+            record = {col: _jsonable(entry.get(col)) for col in COLUMNS}
+            record["_qid"] = uuid.uuid4().hex
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        with self.lock, self._file_lock, open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def peek(self, limit=None):
+        with self.lock, self._file_lock:
+            entries = self._read()
+        return entries if limit is None else entries[:limit]
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def ack(self, entries):
+        # 移除已上傳的記錄 (以 _qid 辨識)
+        with self.lock, self._file_lock:
+            done = {e["_qid"] for e in entries}
+            rest = [e for e in self._read() if e.get("_qid") not in done]
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in rest:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+
+    def __len__(self):
+        return len(self.peek())
+
+
+def git_blob_sha(data):
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def shard_of(date):
+    # 一個月一個分片：history/2025-12.csv
+    return str(date)[:7]
+
+
+# --- 背景同步 ---
+# 存檔進佇列後立刻返回；背景執行緒把累積的記錄依月份分片，只上傳有變動的分片
+class GithubSync:
+    def __init__(self, repo_factory, path, branch, queue_file, shard_dir="history", cache_dir=None,
+                 batch_size=200, interval=30.0, batch_delay=1.0, max_backoff=300.0,
+                 conflict_retries=5, ttl=60, fetch_workers=8):
+        self.repo_factory = repo_factory
+        # path 是舊版的單一 CSV，保留唯讀；新記錄都寫到 shard_dir
+        self.path = path
+        self.shard_dir = shard_dir
+        self.branch = branch
+        self.queue = SyncQueue(queue_file)
+        self.cache_dir = cache_dir or os.path.splitext(queue_file)[0] + ".shard_cache"
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batch_delay = batch_delay
+        self.max_backoff = max_backoff
+        self.conflict_retries = conflict_retries
+        self.ttl = ttl
+        self.fetch_workers = fetch_workers
+        self.last_error = None
+        self.last_sync = None
+        # 本地對帳 (reconcile.Reconciler)：每輪上傳完佇列後跑一次，錯誤與退避跟上傳共用
+        self.reconciler = None
+        self._repo = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # 遠端內容快取：分片路徑 -> (blob SHA, DataFrame)
+        self._lock = threading.Lock()
+        self._shards = {}
+        self.remote_df = None
+        self._remote_checked = 0.0
+
+    @property
+    def repo(self):
+        # 同一個 repo 物件重複使用，不必每次存檔都 get_repo；每個 API 呼叫的次數/延遲記在 github.*
+        if self._repo is None:
+            self._repo = telemetry.InstrumentedClient(self.repo_factory(), "github")
+        return self._repo
+
+    def shard_path(self, month):
+        return f"{self.shard_dir}/{month}.csv"
+
+    # --- 讀取 ---
+    def _list_remote(self):
+        # 列出分片 (一次 API)，加上舊版單檔 (若還在)
+        files = []
+        try:
+            listing = self.repo.get_contents(self.shard_dir, ref=self.branch)
+            files = [c for c in listing if c.path.endswith(".csv")]
+        except UnknownObjectException:
+            pass
+        try:
+            files.append(self.repo.get_contents(self.path, ref=self.branch))
+        except UnknownObjectException:
+            pass
+        return files
+
+    def _cached_path(self, sha):
+        return os.path.join(self.cache_dir, f"{sha}.csv")
+
+    def _drop_cached(self, sha):
+        # 分片換成新版本或被刪除：舊版本的快取檔不會再用到，不刪的話每次遠端變動都多留一份
+        if sha is None:
+            return
+        try:
+            os.remove(self._cached_path(sha))
+        except FileNotFoundError:
+            pass
+
+    def _fetch_shard(self, content):
+        # 本地依 blob SHA 快取，同一版本只下載一次
+        cached = self._cached_path(content.sha)
+        try:
+            with open(cached, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = self.repo.get_contents(content.path, ref=self.branch).decoded_content
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(cached + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(cached + ".tmp", cached)
+        return clean_history(pd.read_csv(io.BytesIO(data)))
+
+    @telemetry.timed("sync.load_remote")
+    def load_remote(self):
+        # ttl 內直接用快取；超過才列一次目錄，只下載 SHA 有變的分片 (平行)
+        with self._lock:
+            now = time.monotonic()
+            if self.remote_df is not None and now - self._remote_checked < self.ttl:
+                return self.remote_df
+            files = self._list_remote()
+            changed = [c for c in files if self._shards.get(c.path, (None,))[0] != c.sha]
+            removed = set(self._shards) - {c.path for c in files}
+            if changed:
+                with ThreadPoolExecutor(max_workers=self.fetch_workers) as pool:
+                    frames = list(pool.map(self._fetch_shard, changed))
+                for content, df in zip(changed, frames):
+                    self._drop_cached(self._shards.get(content.path, (None,))[0])
+                    self._shards[content.path] = (content.sha, df)
+            for path in removed:
+                self._drop_cached(self._shards.pop(path)[0])
+            if changed or removed or self.remote_df is None:
+                self._rebuild_view()
+            self._remote_checked = now
+            return self.remote_df
+
+    def remote_version(self):
+        # 目前快取的遠端版本 (各分片的 blob SHA)
+        with self._lock:
+            return tuple(sorted((path, s[0]) for path, s in self._shards.items()))
+
+    def _rebuild_view(self):
+        # 舊版單檔排最前面，其餘分片依月份排序
+        paths = sorted(self._shards, key=lambda p: (p != self.path, p))
+        frames = [self._shards[p][1] for p in paths if not self._shards[p][1].empty]
+        self.remote_df = pd.concat(frames, ignore_index=True) if frames else clean_history(pd.DataFrame(columns=COLUMNS))
+
+    def view(self):
+        # 遠端內容 + 還在佇列裡的記錄；上傳確認與出佇列在同一把鎖內，不會重複或遺漏
+        self.load_remote()
+        with self.queue.lock:
+            df = self.remote_df
+            pending = self.queue.peek()
+        if not pending:
+            return df
+        return pd.concat([df, clean_history(pd.DataFrame(pending))], ignore_index=True)
+
+    # --- 寫入 ---
+    def enqueue(self, entry):
+        self.enqueue_many([entry])
+
+    def enqueue_many(self, entries):
+        self.queue.put_many(entries)
+        self.start()
+        self._wake.set()
+
+    @telemetry.timed("sync.push_full")
+    def push_full(self, df, base=None):
+        # 整份覆寫 (對帳的內容衝突用)，同步執行；內容沒變的分片不會上傳
+        # base 的意義與 SessionLog.rewrite 相同：呼叫端算出 df 時讀到的遠端，之後別的裝置新加的記錄會保留
+        # 一定重新列一次目錄，不用 ttl 內的快取：SHA 舊了每個分片都會衝突一次
+        with self._lock:
+            self._remote_checked = 0.0
+        self.load_remote()
+        months = df['Date'].dt.strftime("%Y-%m")
+        wanted = {self.shard_path(m): part for m, part in df.groupby(months)}
+        message = f"Rewrite {len(df)} sessions {datetime.now():%Y-%m-%d %H:%M}"
+        with self._lock:
+            current = dict(self._shards)
+        empty = clean_history(pd.DataFrame(columns=COLUMNS))
+        for path, part in wanted.items():
+            sha, latest = current.get(path, (None, empty))
+            if base is not None:
+                part = merge_new_rows(part, base, latest)
+            self._rewrite_shard(path, part, latest, sha, message)
+        # 舊版單檔 (內容已分進各月份) 與沒有資料的分片才刪；刪之前再讀一次，期間別的裝置寫過的不動
+        for path, (sha, _) in current.items():
+            if path in wanted:
+                continue
+            try:
+                contents = self.repo.get_contents(path, ref=self.branch)
+            except UnknownObjectException:
+                continue
+            rows = contents.decoded_content.decode("utf-8").strip().splitlines()[1:]
+            if not (path == self.path and contents.sha == sha) and rows:
+                continue
+            try:
+                self.repo.delete_file(path, message, contents.sha, branch=self.branch)
+            except GithubException as e:
+                if e.status in (409, 422) and not isinstance(e, RateLimitExceededException):
+                    logger.info("GitHub SHA conflict deleting %s, keeping it", path)
+                    telemetry.count("sync.sha_conflicts")
+                    continue
+                raise
+        with self._lock:
+            self._remote_checked = 0.0
+
+    def _rewrite_shard(self, path, part, base, sha, message):
+        # 覆寫一個分片；base 是讀到 sha 那一版的內容
+        # SHA 衝突與 _append_to_shard 相同處理：重抓最新內容，把期間別人新加的記錄併進來再寫
+        for _ in range(self.conflict_retries):
+            body = part.to_csv(index=False, columns=COLUMNS).encode("utf-8")
+            if sha == git_blob_sha(body):
+                return
+            try:
+                if sha is None:
+                    self.repo.create_file(path, message, body, branch=self.branch)
+                else:
+                    self.repo.update_file(path, message, body, sha, branch=self.branch)
+                return
+            except GithubException as e:
+                if not (e.status in (409, 422) and not isinstance(e, RateLimitExceededException)):
+                    raise
+                logger.info("GitHub SHA conflict on %s, retrying", path)
+                telemetry.count("sync.sha_conflicts")
+            try:
+                contents = self.repo.get_contents(path, ref=self.branch)
+                sha, data = contents.sha, contents.decoded_content
+            except UnknownObjectException:
+                sha, data = None, b""
+            latest = clean_history(pd.read_csv(io.BytesIO(data))) if data.strip() else base.iloc[:0]
+            part = merge_new_rows(part, base, latest)
+            base = latest
+        raise GithubException(409, {"message": f"SHA conflict on {path} persisted after {self.conflict_retries} retries"})
+
+    @telemetry.timed("sync.flush_once")
+    def flush_once(self):
+        # 上傳一批；每個月份分片各自一個 commit。回傳 False 表示佇列已空
+        entries = self.queue.peek(self.batch_size)
+        if not entries:
+            return False
+        groups = {}
+        for entry in entries:
+            groups.setdefault(shard_of(entry['Date']), []).append(entry)
+        for month, rows in sorted(groups.items()):
+            path = self.shard_path(month)
+            base_sha, new_sha = self._append_to_shard(path, rows)
+            with self.queue.lock:
+                self._advance_remote(path, base_sha, new_sha, rows)
+                self.queue.ack(rows)
+            telemetry.count("sync.uploaded_rows", len(rows))
+            self.last_sync = datetime.now()
+        return True
+
+    def _append_to_shard(self, path, rows):
+        message = f"Auto-save {len(rows)} sessions {datetime.now():%Y-%m-%d %H:%M}"
+        for _ in range(self.conflict_retries):
+            try:
+                contents = self.repo.get_contents(path, ref=self.branch)
+                base_sha = contents.sha
+                text = contents.decoded_content.decode("utf-8")
+            except UnknownObjectException:
+                contents, base_sha, text = None, None, ""
+            if text and not text.endswith("\n"):
+                text += "\n"
+            body = text + rows_to_csv(rows, header=not text)
+            try:
+                if contents is None:
+                    result = self.repo.create_file(path, message, body, branch=self.branch)
+                else:
+                    result = self.repo.update_file(contents.path, message, body, base_sha, branch=self.branch)
+            except GithubException as e:
+                # SHA 衝突：其他裝置剛寫過，重抓最新內容再接上去
+                if e.status in (409, 422) and not isinstance(e, RateLimitExceededException):
+                    logger.info("GitHub SHA conflict on %s, retrying", path)
+                    telemetry.count("sync.sha_conflicts")
+                    continue
+                raise
+            return base_sha, result['content'].sha
+        raise GithubException(409, {"message": f"SHA conflict on {path} persisted after {self.conflict_retries} retries"})
+
+    def _advance_remote(self, path, base_sha, new_sha, entries):
+        # 分片正好是我們快取的版本：直接接上這批，不必重新下載
+        with self._lock:
+            if self.remote_df is None or self._shards.get(path, (None,))[0] != base_sha:
+                # 中間有別人寫入：讓下一次讀取重新下載
+                self._remote_checked = 0.0
+                return
+            rows = clean_history(pd.DataFrame(entries))
+            df = pd.concat([self._shards[path][1], rows], ignore_index=True) if path in self._shards else rows
+            self._shards[path] = (new_sha, df)
+            self._drop_cached(base_sha)
+            self.remote_df = pd.concat([self.remote_df, rows], ignore_index=True)
+
+    # --- 背景執行緒 ---
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        # 啟動後馬上跑第一輪 (補傳、對帳)，不必等滿一個 interval
+        self._wake.set()
+        self._thread = threading.Thread(target=self._run, name="github-sync", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        # 不等滿 interval，馬上跑一輪 (上傳 + 對帳)
+        self.start()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        backoff = 0.0
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            # 稍等一下，讓連續的存檔合成同一批
+            if self._stop.wait(self.batch_delay):
+                break
+            try:
+                while self.flush_once():
+                    pass
+                if self.reconciler is not None:
+                    self.reconciler.run_once()
+                backoff = 0.0
+                self.last_error = None
+                continue
+            except RateLimitExceededException as e:
+                delay = _rate_limit_delay(e)
+                self.last_error = e
+                telemetry.count("sync.rate_limited")
+                logger.warning("GitHub rate limit hit, sleeping %.0fs", delay)
+            except BadCredentialsException as e:
+                # token 失效就重建 repo 物件，並用最長的間隔重試
+                self._repo = None
+                delay = self.max_backoff
+                self.last_error = e
+                logger.error("GitHub credentials rejected: %s", e)
+            except Exception as e:
+                backoff = min(max(backoff * 2, 1.0), self.max_backoff)
+                delay = backoff * random.uniform(0.5, 1.0)
+                self.last_error = e
+                logger.warning("GitHub sync failed (%s), retrying in %.1fs", e, delay)
+            self._stop.wait(delay)
+
+
+def _rate_limit_delay(e, default=60.0):
+    headers = {k.lower(): v for k, v in (getattr(e, "headers", None) or {}).items()}
+    if "retry-after" in headers:
+        return float(headers["retry-after"])
+    if "x-ratelimit-reset" in headers:
+        return max(float(headers["x-ratelimit-reset"]) - time.time(), 1.0)
+    return default
+
+
+# --- 本地 GitHub 替身 ---
+# 用資料夾模擬 contents API (SHA 用 git blob 算法)，開發與測試時不用連網
+class LocalContent:
+    def __init__(self, path, data):
+        self.path = path
+        self.decoded_content = data
+        self.sha = git_blob_sha(data)
+
+
+class LocalRepo:
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _file(self, path):
+        return os.path.join(self.root, path)
+
+    def get_contents(self, path, ref=None):
+        full = self._file(path)
+        if not os.path.exists(full):
+            raise UnknownObjectException(404, {"message": "Not Found"}, {})
+        if os.path.isdir(full):
+            return [self.get_contents(f"{path}/{name}") for name in sorted(os.listdir(full))]
+        with open(full, "rb") as f:
+            return LocalContent(path, f.read())
+
+    def create_file(self, path, message, content, branch=None):
+        with self._lock:
+            if os.path.exists(self._file(path)):
+                raise GithubException(422, {"message": "\"sha\" wasn't supplied."}, {})
+            return self._write(path, content)
+
+    def update_file(self, path, message, content, sha, branch=None):
+        with self._lock:
+            if self.get_contents(path).sha != sha:
+                raise GithubException(409, {"message": f"{path} does not match {sha}"}, {})
+            return self._write(path, content)
+
+    def delete_file(self, path, message, sha, branch=None):
+        with self._lock:
+            if self.get_contents(path).sha != sha:
+                raise GithubException(409, {"message": f"{path} does not match {sha}"}, {})
+            os.remove(self._file(path))
+            return {"content": None, "commit": None}
+
+    def _write(self, path, content):
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        full = self._file(path)
+        os.makedirs(os.path.dirname(full) or ".", exist_ok=True)
+        with open(full, "wb") as f:
+            f.write(data)
+        return {"content": LocalContent(path, data), "commit": None}
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+# --- 執行時間與計數 ---
+# 預設關閉：timed / span 只多一次旗標檢查
+# 環境變數 RAP_TELEMETRY=1 整個程序都記錄 (含背景同步執行緒)；網址加 ?debug=1 只記錄那次 rerun 的執行緒，
+# 每次 rerun 開頭由 begin_rerun 重新決定，不會讓其他使用者的 session 一起付計時的成本
+# 計時依名稱累計 (次數 / 總時間 / 最長 / 最近一次)，巢狀的區段各自計時 (外層包含內層)
+# 另外每個執行緒記下「這次 rerun」各段的時間，診斷頁用來看一次 rerun 的時間花在哪
+# GitHub 呼叫由 InstrumentedClient 包起來，次數、延遲與錯誤記在 github.<方法> 底下
+_enabled = os.environ.get("RAP_TELEMETRY") == "1"  # 程序層級
+_lock = threading.Lock()
+_timers = {}    # 名稱 -> [次數, 總秒數, 最長秒數, 最近一次秒數]
+_counters = {}  # 名稱 -> 累計值
+
+
+class _Local(threading.local):
+    # 類別屬性當預設值：沒跑過 begin_rerun 的執行緒 (背景同步) 讀到 False / None，不必走例外
+    on = False
+    rerun = None
+
+
+_local = _Local()
+_NULL_SPAN = nullcontext()
+
+
+def enabled():
+    return _enabled or _local.on
+
+
+def enable(on=True):
+    # 程序層級的開關 (與 RAP_TELEMETRY=1 相同)
+    global _enabled
+    _enabled = bool(on)
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def record(name, seconds):
+    if not enabled():
+        return
+    with _lock:
+        stat = _timers.get(name)
+        if stat is None:
+            _timers[name] = [1, seconds, seconds, seconds]
+        else:
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+            stat[3] = seconds
+    rerun = _local.rerun
+    if rerun is not None:
+        rerun[name] = rerun.get(name, 0.0) + seconds
+
+
+def count(name, n=1):
+    if not enabled():
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    # with telemetry.span("page.stats"): ...
+    return _Span(name) if enabled() else _NULL_SPAN
+
+
+def timed(name):
+    # 裝飾器；關閉時直接呼叫原函式
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not (_enabled or _local.on):
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# --- 每次 rerun ---
+def begin_rerun(on=False):
+    # 在腳本開頭呼叫；on：這次 rerun 要不要記錄 (?debug=1 / 診斷頁)，程序層級開著時一律記錄
+    # 同一個執行緒之後記錄的時間都算進這次 rerun
+    _local.on = bool(on)
+    _local.rerun = {} if enabled() else None
+
+
+def rerun_timings():
+    # 名稱 -> 毫秒
+    return {name: seconds * 1000 for name, seconds in (_local.rerun or {}).items()}
+
+
+# --- GitHub 呼叫 ---
+class InstrumentedClient:
+    # 代理任意 API 物件 (PyGithub Repository / LocalRepo)：每個方法呼叫記 <prefix>.<方法> 的延遲，
+    # 失敗另外計 <prefix>.errors 與 <prefix>.errors.<HTTP 狀態>
+    def __init__(self, target, prefix="github"):
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if not callable(value):
+            return value
+        name = f"{self._prefix}.{attr}"
+
+        def call(*args, **kwargs):
+            if not enabled():
+                return value(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            except Exception as e:
+                count(f"{self._prefix}.errors")
+                count(f"{self._prefix}.errors.{getattr(e, 'status', type(e).__name__)}")
+                raise
+            finally:
+                record(name, time.perf_counter() - start)
+        return call
+
+
+# --- 輸出 ---
+def snapshot():
+    with _lock:
+        timers = {name: {"calls": s[0], "total_ms": s[1] * 1000, "mean_ms": s[1] * 1000 / s[0],
+                         "max_ms": s[2] * 1000, "last_ms": s[3] * 1000} for name, s in sorted(_timers.items())}
+        counters = dict(sorted(_counters.items()))
+    return {"enabled": enabled(), "timers": timers, "counters": counters}
+
+
+def to_json():
+    return json.dumps(snapshot(), ensure_ascii=False, indent=2)
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(prefix="rap"):
+    # Prometheus 文字格式；區段名稱放在 name 標籤
+    snap = snapshot()
+    lines = []
+    metrics = [
+        ("section_calls_total", "counter", "Calls per instrumented section.", "calls", 1),
+        ("section_seconds_total", "counter", "Total seconds per instrumented section.", "total_ms", 1e-3),
+        ("section_seconds_max", "gauge", "Slowest call per instrumented section.", "max_ms", 1e-3),
+        ("section_seconds_last", "gauge", "Most recent call per instrumented section.", "last_ms", 1e-3),
+    ]
+    for metric, kind, help_text, field, scale in metrics:
+        lines += [f"# HELP {prefix}_{metric} {help_text}", f"# TYPE {prefix}_{metric} {kind}"]
+        for name, stat in snap["timers"].items():
+            lines.append(f'{prefix}_{metric}{{name="{_label(name)}"}} {stat[field] * scale:g}')
+    lines += [f"# HELP {prefix}_events_total Event counters.", f"# TYPE {prefix}_events_total counter"]
+    for name, value in snap["counters"].items():
+        lines.append(f'{prefix}_events_total{{name="{_label(name)}"}} {value:g}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pandas as pd
+
+# 模組都放在 repo 根目錄
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync import GithubSync, LocalRepo
+
+
+# --- 共用的測試資料 ---
+def entry(day, bpm=90, note="1/16"):
+    return {'Date': pd.Timestamp(f"2026-01-{day:02d} 10:00:00"), 'BPM': bpm, 'Note_Type': note, 'SPS': bpm * 4 / 60,
+            'Duration': 2.0, 'Focus': "Auto-log"}
+
+
+def make_sync(tmp_path, repo_factory=None, queue="sync.jsonl", **kwargs):
+    # 所有裝置共用 tmp_path/remote 這個本地 GitHub 替身
+    remote = tmp_path / "remote"
+    factory = repo_factory or (lambda: LocalRepo(str(remote)))
+    kwargs.setdefault("ttl", 0)
+    kwargs.setdefault("batch_delay", 0)
+    return GithubSync(factory, "rap_log_v8.csv", "main", str(tmp_path / queue), **kwargs)
@@ -0,0 +1,102 @@
+import time
+
+import pandas as pd
+
+from conftest import entry, make_sync
+from reconcile import Reconciler, merge_histories
+from storage import HistoryCache, SessionLog
+
+
+def make_device(tmp_path, name="local"):
+    folder = tmp_path / name
+    folder.mkdir()
+    cache = HistoryCache(SessionLog(str(folder / "rap_log_v8.csv")))
+    sync = make_sync(tmp_path, queue=f"{name}.jsonl")
+    return Reconciler(cache, sync)
+
+
+def seed_remote(tmp_path, *entries):
+    # 另一台裝置已經上傳的記錄
+    other = make_sync(tmp_path, queue="other.jsonl")
+    other.queue.put_many(list(entries))
+    while other.flush_once():
+        pass
+
+
+def drain(sync, timeout=5):
+    # enqueue 會叫醒背景執行緒上傳；等佇列清空再停掉
+    deadline = time.monotonic() + timeout
+    while len(sync.queue) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    sync.stop(2)
+    assert len(sync.queue) == 0
+
+
+def bpms(df):
+    return sorted(df['BPM'].astype(float).tolist())
+
+
+# --- merge_histories ---
+def test_merge_histories_splits_missing_rows_each_way():
+    local = pd.DataFrame([entry(1), entry(2)])
+    remote = pd.DataFrame([entry(2), entry(3), entry(3)])
+    to_local, to_remote, merged = merge_histories(local, remote)
+    # 遠端重複上傳的同一筆只拉一次
+    assert to_local['Date'].tolist() == [pd.Timestamp("2026-01-03 10:00:00")]
+    assert to_remote['Date'].tolist() == [pd.Timestamp("2026-01-01 10:00:00")]
+    assert merged is None
+
+
+def test_merge_histories_conflict_is_order_independent():
+    local = pd.DataFrame([entry(1, 90)])
+    remote = pd.DataFrame([entry(1, 95)])
+    _, _, a = merge_histories(local, remote)
+    _, _, b = merge_histories(remote, local)
+    assert bpms(a) == bpms(b) == [95.0]
+
+
+# --- Reconciler.run_once ---
+def test_pull_only(tmp_path):
+    seed_remote(tmp_path, entry(1, 80), entry(2, 85))
+    device = make_device(tmp_path)
+    result = device.run_once()
+    assert result == {"to_local": 2, "to_remote": 0, "conflicts": False}
+    assert bpms(device.cache.load()) == [80.0, 85.0]
+    assert len(device.sync.queue) == 0
+    # 第二輪沒有可做的事
+    assert device.run_once() == {"to_local": 0, "to_remote": 0, "conflicts": False}
+
+
+def test_push_only(tmp_path):
+    device = make_device(tmp_path)
+    device.log.append(entry(1, 80))
+    device.log.append(entry(2, 85))
+    result = device.run_once()
+    assert result == {"to_local": 0, "to_remote": 2, "conflicts": False}
+    drain(device.sync)
+    assert bpms(device.sync.load_remote()) == [80.0, 85.0]
+    assert device.run_once() == {"to_local": 0, "to_remote": 0, "conflicts": False}
+
+
+def test_pending_rows_are_not_queued_twice(tmp_path):
+    device = make_device(tmp_path)
+    device.log.append(entry(1, 80))
+    # 存檔時已經排進上傳佇列 (還沒上傳)
+    device.sync.queue.put(entry(1, 80))
+    assert device.run_once()["to_remote"] == 0
+    assert len(device.sync.queue) == 1
+
+
+def test_same_timestamp_conflict_converges_within_two_passes(tmp_path):
+    seed_remote(tmp_path, entry(1, 95), entry(2, 70))
+    device = make_device(tmp_path)
+    device.log.append(entry(1, 90))
+    device.log.append(entry(3, 100))
+    first = device.run_once()
+    assert first["conflicts"]
+    second = device.run_once()
+    assert second == {"to_local": 0, "to_remote": 0, "conflicts": False}
+    # 兩邊是同一份合併結果，衝突那筆取 BPM 較大的版本
+    local, remote = device.cache.load(), device.sync.load_remote()
+    assert bpms(local) == bpms(remote) == [70.0, 95.0, 100.0]
+    assert len(device.sync.queue) == 0
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+import notes
+from aggregates import HistoryIndex
+from conftest import entry
+from storage import HistoryCache, SessionLog
+
+
+# --- 自訂音符標籤 ---
+@pytest.mark.parametrize("name", ["rap_log_v8.csv", "rap_log_v8.arrow"])
+def test_unknown_note_label_survives_compaction(tmp_path, name):
+    log = SessionLog(str(tmp_path / name))
+    log.append(entry(1, note="Freestyle"))
+    log.append(entry(2, note="1/16 (十六分音符 - 快嘴)"))
+    log.compact()
+    assert not (tmp_path / "rap_log_v8.journal.csv").exists()
+    log.append(entry(3, note=" Freestyle "))
+    df = SessionLog(str(tmp_path / name)).read()
+    assert df['Note_Type'].astype(str).tolist() == ["Freestyle", "1/16", "Freestyle"]
+    # 整份覆寫後再讀一次也一樣
+    log.rewrite(df)
+    assert SessionLog(str(tmp_path / name)).read()['Note_Type'].astype(str).tolist() == ["Freestyle", "1/16", "Freestyle"]
+
+
+def test_unknown_note_label_keeps_registry_codes(tmp_path):
+    log = SessionLog(str(tmp_path / "rap_log_v8.csv"))
+    log.append(entry(1, note="1/16"))
+    cache = HistoryCache(log)
+    cache.load()
+    log.append(entry(2, note="Freestyle"))
+    df = cache.load()
+    # 標準標籤的代碼不變，自訂標籤接在後面，篩選各自只比對到自己
+    assert df['Note_Type'].cat.categories.tolist() == notes.NOTE_LABELS + ["Freestyle"]
+    assert notes.mask(df['Note_Type'], "1/16").tolist() == [True, False]
+    assert notes.mask(df['Note_Type'], "Freestyle").tolist() == [False, True]
+    assert cache.index.minutes("1/16") == 2.0
+
+
+# --- 摘要索引 ---
+def test_history_index_version_tracks_sps_and_per_note_minutes():
+    base = pd.DataFrame([entry(1, note="1/16"), entry(2, note="1/8")])
+    version = HistoryIndex.from_frame(base).version()
+    # 只提高 SPS (BPM、分鐘都不變)
+    assert HistoryIndex.from_frame(base.assign(SPS=base['SPS'] + 1)).version() != version
+    # 總分鐘不變，但時間換到另一種音符
+    moved = base.assign(Duration=[3.0, 1.0])
+    assert HistoryIndex.from_frame(moved).version() != version
+    assert HistoryIndex.from_frame(base.copy()).version() == version
+
+
+# --- Arrow 搬移 ---
+def test_migrate_to_arrow_dedupes_across_sources_only(tmp_path):
+    from storage import migrate_to_arrow
+    twice = pd.DataFrame([entry(1), entry(1), entry(2)])
+    twice.to_csv(tmp_path / "rap_log_v5.csv", index=False)
+    # v8 是 v5 複製過來再加一筆
+    pd.concat([twice, pd.DataFrame([entry(3)])]).to_csv(tmp_path / "rap_log_v8.csv", index=False)
+    pd.DataFrame([entry(4)]).to_csv(tmp_path / "rap_log_v8.journal.csv", index=False)
+    paths = [str(tmp_path / name) for name in ("rap_log_v5.csv", "rap_log_v8.csv", "rap_log_v8.journal.csv")]
+    arrow = str(tmp_path / "rap_log_v8.arrow")
+    # 同一天兩筆相同的練習都留著，v8 與 v5 重疊的部分只算一次
+    assert migrate_to_arrow(paths, arrow) == 5
+    days = SessionLog(arrow).read()['Date'].dt.day.tolist()
+    assert days == [1, 1, 2, 3, 4]
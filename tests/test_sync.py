@@ -0,0 +1,185 @@
+import time
+
+import pandas as pd
+import pytest
+
+from conftest import entry, make_sync
+from sync import GithubException, LocalRepo, RateLimitExceededException, SyncQueue
+
+
+def remote_bpms(sync):
+    sync.load_remote()
+    return sorted(sync.remote_df['BPM'].astype(int).tolist())
+
+
+# --- 持久佇列 ---
+def test_queue_survives_restart_until_ack(tmp_path):
+    path = str(tmp_path / "sync.jsonl")
+    SyncQueue(path).put_many([entry(1), entry(2)])
+    # 重新開啟 (程式重啟)：記錄還在，上傳確認前不會消失
+    reopened = SyncQueue(path)
+    pending = reopened.peek()
+    assert [e['BPM'] for e in pending] == [90, 90]
+    reopened.ack(pending[:1])
+    assert len(SyncQueue(path)) == 1
+    assert SyncQueue(path).peek()[0]['_qid'] == pending[1]['_qid']
+
+
+def test_restarted_sync_uploads_pending_entries(tmp_path):
+    make_sync(tmp_path).queue.put_many([entry(1, 80), entry(2, 85)])
+    sync = make_sync(tmp_path)
+    while sync.flush_once():
+        pass
+    assert len(sync.queue) == 0
+    assert remote_bpms(sync) == [80, 85]
+
+
+# --- SHA 衝突 ---
+class RacingRepo(LocalRepo):
+    # 第一次寫入前，先讓「另一台裝置」寫進同一個分片，模擬讀取與寫入之間被搶先
+    def __init__(self, root, other):
+        super().__init__(root)
+        self.other = other
+        self.raced = False
+
+    def _race(self):
+        if not self.raced:
+            self.raced = True
+            self.other.queue.put(entry(15, 70))
+            self.other.flush_once()
+
+    def create_file(self, path, message, content, branch=None):
+        self._race()
+        return super().create_file(path, message, content, branch)
+
+    def update_file(self, path, message, content, sha, branch=None):
+        self._race()
+        return super().update_file(path, message, content, sha, branch)
+
+
+@pytest.mark.parametrize("existing", [False, True])
+def test_sha_conflict_is_retried_on_latest_content(tmp_path, existing):
+    # existing=False：兩邊同時建立分片 (422)；True：同時更新 (409)
+    other = make_sync(tmp_path, queue="other.jsonl")
+    if existing:
+        other.queue.put(entry(1, 60))
+        other.flush_once()
+    repo = RacingRepo(str(tmp_path / "remote"), other)
+    sync = make_sync(tmp_path, lambda: repo)
+    sync.queue.put(entry(20, 100))
+    assert sync.flush_once()
+    assert repo.raced
+    assert len(sync.queue) == 0
+    # 對方的記錄沒被蓋掉，這邊的接在後面
+    assert remote_bpms(sync) == ([60] if existing else []) + [70, 100]
+
+
+def test_sha_conflict_gives_up_after_retries(tmp_path):
+    class AlwaysConflict(LocalRepo):
+        def create_file(self, path, message, content, branch=None):
+            raise GithubException(409, {"message": "conflict"}, {})
+
+    sync = make_sync(tmp_path, lambda: AlwaysConflict(str(tmp_path / "remote")), conflict_retries=3)
+    sync.queue.put(entry(1))
+    with pytest.raises(GithubException):
+        sync.flush_once()
+    # 沒上傳成功的記錄留在佇列
+    assert len(sync.queue) == 1
+
+
+# --- 流量限制 ---
+class RateLimitedRepo(LocalRepo):
+    # 前 limited 次寫入回 403 rate limit (Retry-After 秒數)，之後正常
+    def __init__(self, root, limited=1, retry_after="0.3"):
+        super().__init__(root)
+        self.limited = limited
+        self.retry_after = retry_after
+        self.calls = []
+
+    def create_file(self, path, message, content, branch=None):
+        self.calls.append(time.monotonic())
+        if len(self.calls) <= self.limited:
+            raise RateLimitExceededException(403, {"message": "API rate limit exceeded"},
+                                             {"Retry-After": self.retry_after})
+        return super().create_file(path, message, content, branch)
+
+
+def test_rate_limit_waits_retry_after_then_uploads(tmp_path):
+    repo = RateLimitedRepo(str(tmp_path / "remote"))
+    sync = make_sync(tmp_path, lambda: repo, interval=0.05)
+    sync.enqueue(entry(1))
+    try:
+        deadline = time.monotonic() + 5
+        while len(sync.queue) and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        sync.stop(2)
+    assert len(sync.queue) == 0
+    assert len(repo.calls) == 2
+    # 第二次呼叫至少等了 Retry-After
+    assert repo.calls[1] - repo.calls[0] >= 0.3
+    assert sync.last_error is None
+
+
+def test_rate_limit_sets_last_error_while_waiting(tmp_path):
+    repo = RateLimitedRepo(str(tmp_path / "remote"), limited=10, retry_after="60")
+    sync = make_sync(tmp_path, lambda: repo, interval=0.05)
+    sync.enqueue(entry(1))
+    try:
+        deadline = time.monotonic() + 5
+        while sync.last_error is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert isinstance(sync.last_error, RateLimitExceededException)
+        time.sleep(0.3)
+        # 等待中不會再呼叫 API
+        assert len(repo.calls) == 1
+    finally:
+        sync.stop(2)
+    assert len(sync.queue) == 1
+
+
+# --- 整份覆寫 ---
+def test_push_full_keeps_rows_written_after_a_stale_listing(tmp_path):
+    sync = make_sync(tmp_path, ttl=3600)
+    sync.queue.put(entry(1, 80))
+    sync.flush_once()
+    sync.load_remote()
+    # 快取還在 ttl 內時另一台裝置寫進同一個分片
+    other = make_sync(tmp_path, queue="other.jsonl")
+    other.queue.put(entry(2, 85))
+    other.flush_once()
+    stale = sync.remote_df
+    sync.push_full(stale.assign(BPM=95), base=stale)
+    assert remote_bpms(make_sync(tmp_path, queue="check.jsonl")) == [85, 95]
+
+
+def test_push_full_retries_when_a_shard_changes_mid_write(tmp_path):
+    other = make_sync(tmp_path, queue="other.jsonl")
+    other.queue.put(entry(1, 60))
+    other.flush_once()
+    repo = RacingRepo(str(tmp_path / "remote"), other)
+    sync = make_sync(tmp_path, lambda: repo)
+    remote = sync.load_remote()
+    sync.push_full(remote.assign(BPM=65), base=remote)
+    assert repo.raced
+    assert remote_bpms(make_sync(tmp_path, queue="check.jsonl")) == [65, 70]
+
+
+@pytest.mark.parametrize("changed", [False, True])
+def test_push_full_only_deletes_the_legacy_file_it_read(tmp_path, changed):
+    legacy = LocalRepo(str(tmp_path / "remote"))
+    legacy.create_file("rap_log_v8.csv", "seed", pd.DataFrame([entry(1, 80)]).to_csv(index=False))
+
+    class LegacyWriter(LocalRepo):
+        # 第一次寫分片時，舊版單檔剛好被舊版 app 追加了一筆
+        def create_file(self, path, message, content, branch=None):
+            if changed and path != "rap_log_v8.csv":
+                contents = self.get_contents("rap_log_v8.csv")
+                text = contents.decoded_content.decode("utf-8") + pd.DataFrame([entry(2, 85)]).to_csv(index=False, header=False)
+                self.update_file("rap_log_v8.csv", "legacy", text, contents.sha)
+            return super().create_file(path, message, content, branch)
+
+    sync = make_sync(tmp_path, lambda: LegacyWriter(str(tmp_path / "remote")))
+    sync.push_full(sync.load_remote())
+    assert (tmp_path / "remote" / "rap_log_v8.csv").exists() == changed
+    assert remote_bpms(make_sync(tmp_path, queue="check.jsonl")) == ([80, 80, 85] if changed else [80])
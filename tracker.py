@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from locking import FileLock
+
+# --- 練習計時 (伺服器端) ---
+# 開始 / 心跳 / 停止 / 存檔或放棄 都寫進只追加的 JSONL 日誌，練習時長從日誌算，不依賴 session_state：
+# 伺服器重啟或 websocket 斷線後，新的 session 讀日誌就能接回進行中的練習，
+# 或把太久沒心跳的練習以最後一次心跳的時間收尾，等使用者決定存檔或放棄
+# 記憶體只保留還沒結案的練習；全部結案且日誌變大時整份清空，不必掃描練習歷史
+# 每筆練習記下開始它的分頁 (owner)：進行中的練習只由同一個分頁接回，別的分頁或訓練者不會搶走；
+# 已中斷 (太久沒心跳) 的練習沒有人在播，誰開啟都可以收尾
+HEARTBEAT_SECONDS = 15
+STALE_SECONDS = 60  # 超過這麼久沒心跳就當作中斷
+ROTATE_BYTES = 64 * 1024
+OUTCOMES = ("saved", "discarded")
+
+
+def tracker_path(data_file):
+    base, _ = os.path.splitext(data_file)
+    return f"{base}.sessions.jsonl"
+
+
+class SessionTracker:
+    def __init__(self, path, heartbeat_every=HEARTBEAT_SECONDS, stale_after=STALE_SECONDS):
+        self.path = path
+        self.heartbeat_every = heartbeat_every
+        self.stale_after = stale_after
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + ".lock")
+        # 練習 ID -> {"start", "last_seen", "stopped", "info"}；結案後移除
+        self._open = {}
+        self._offset = 0
+
+    # --- 日誌 ---
+    def _append(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock, self._file_lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.refresh()
+
+    def refresh(self):
+        # 只讀上次之後新增的行 (其他程序寫的也會讀到)；日誌被清空過就從頭重讀
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size < self._offset:
+                self._open, self._offset = {}, 0
+            if size == self._offset:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1
+            self._offset += end
+            for line in chunk[:end].decode("utf-8").splitlines():
+                if line.strip():
+                    self._apply(json.loads(line))
+
+    def _apply(self, event):
+        sid, t = event["id"], event["t"]
+        kind = event["event"]
+        if kind == "start":
+            self._open[sid] = {"start": t, "last_seen": t, "stopped": None, "info": event.get("info", {}),
+                               "owner": event.get("owner")}
+            return
+        session = self._open.get(sid)
+        if session is None:
+            return
+        if kind == "heartbeat":
+            session["last_seen"] = max(session["last_seen"], t)
+        elif kind == "stop" and session["stopped"] is None:
+            session["stopped"] = t
+            session["last_seen"] = max(session["last_seen"], t)
+            session["info"].update(event.get("info", {}))
+            session["recovered"] = event.get("recovered", False)
+        elif kind in OUTCOMES:
+            del self._open[sid]
+
+    def _rotate(self):
+        # 沒有未結案的練習時才清空；其他程序下次 refresh 看到檔案變短會從頭讀
+        with self._lock, self._file_lock:
+            self.refresh()
+            if self._open or self._offset < ROTATE_BYTES:
+                return
+            tmp = self.path + ".tmp"
+            open(tmp, "w").close()
+            os.replace(tmp, self.path)
+            self._offset = 0
+
+    # --- 事件 ---
+    def start(self, owner=None, **info):
+        sid = uuid.uuid4().hex
+        self._append({"event": "start", "id": sid, "t": time.time(), "owner": owner, "info": info})
+        return sid
+
+    def heartbeat(self, sid, now=None):
+        # 節流：距離上次心跳不到 heartbeat_every 秒就不寫
+        now = now or time.time()
+        session = self.get(sid)
+        if session is None or session["stopped"] is not None or now - session["last_seen"] < self.heartbeat_every:
+            return False
+        self._append({"event": "heartbeat", "id": sid, "t": now})
+        return True
+
+    def stop(self, sid, at=None, recovered=False, **info):
+        # info：停止時的 BPM / 音符等，蓋過開始時記的值；回傳練習秒數
+        session = self.get(sid)
+        if session is None:
+            return None
+        if session["stopped"] is None:
+            self._append({"event": "stop", "id": sid, "t": at or time.time(), "recovered": recovered, "info": info})
+        return self.elapsed(sid)
+
+    def resolve(self, sid, outcome):
+        if outcome not in OUTCOMES:
+            raise ValueError(f"unknown outcome: {outcome}")
+        if self.get(sid) is None:
+            return
+        self._append({"event": outcome, "id": sid, "t": time.time()})
+        self._rotate()
+
+    # --- 查詢 ---
+    def get(self, sid):
+        self.refresh()
+        with self._lock:
+            session = self._open.get(sid)
+            return dict(session) if session is not None else None
+
+    def elapsed(self, sid, now=None):
+        session = self.get(sid)
+        if session is None:
+            return None
+        end = session["stopped"] if session["stopped"] is not None else (now or time.time())
+        return max(end - session["start"], 0.0)
+
+    def recover(self, owner=None, now=None):
+        # 啟動時呼叫：太久沒心跳的練習以最後一次心跳收尾
+        # 回傳 (還在進行的練習 ID, 已停止但未存檔/放棄的練習 ID)，各自依開始時間排序
+        # 只回傳 owner 自己的練習，加上中斷後收尾的練習 (那些沒有人在播)
+        now = now or time.time()
+        self.refresh()
+        with self._lock:
+            sessions = sorted(self._open.items(), key=lambda kv: kv[1]["start"])
+        running, pending = [], []
+        for sid, session in sessions:
+            mine = session.get("owner") == owner
+            if session["stopped"] is None and now - session["last_seen"] > self.stale_after:
+                self.stop(sid, at=session["last_seen"], recovered=True)
+                pending.append(sid)
+            elif session["stopped"] is None and mine:
+                running.append(sid)
+            elif session["stopped"] is not None and (mine or session.get("recovered")):
+                pending.append(sid)
+        return running, pending
@@ -0,0 +1,102 @@
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from storage import COLUMNS, SessionLog, clean_history, row_keys
+
+# --- 匯出 / 匯入 (分塊串流) ---
+# 匯出：一次只把 chunk_rows 筆轉成 CSV 寫進暫存檔，不會同時持有整份字串和 bytes
+# 匯入：外部 CSV (含 v3/v5 舊格式) 分塊讀取、驗證、去重後追加進日誌，記憶體只跟 chunk 大小有關
+CHUNK_ROWS = 50_000
+BPM_RANGE = (30, 400)
+MAX_DURATION = 600  # 單次練習上限 (分鐘)
+
+
+def export_mask(df, start=None, end=None, notes=None):
+    # start / end 是日期 (含當天)，notes 是 Note_Type 標籤清單
+    mask = np.ones(len(df), dtype=bool)
+    if start is not None:
+        mask &= (df['Date'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (df['Date'] < pd.Timestamp(end) + pd.Timedelta(days=1)).to_numpy()
+    if notes:
+        mask &= df['Note_Type'].isin(list(notes)).to_numpy()
+    return mask
+
+
+def write_csv_chunks(df, out, start=None, end=None, notes=None, chunk_rows=CHUNK_ROWS):
+    # out：文字模式的檔案物件；回傳寫出筆數
+    rows = np.flatnonzero(export_mask(df, start, end, notes))
+    columns = [c for c in COLUMNS if c in df.columns]
+    out.write(",".join(columns) + "\n")
+    for i in range(0, len(rows), chunk_rows):
+        df.iloc[rows[i:i + chunk_rows]].to_csv(out, index=False, header=False, columns=columns, lineterminator="\n")
+    return len(rows)
+
+
+def export_csv_file(df, start=None, end=None, notes=None, chunk_rows=CHUNK_ROWS):
+    # 寫到暫存檔，回傳已倒回開頭的二進位檔案物件 (給 st.download_button)
+    f = tempfile.TemporaryFile(mode="w+b")
+    with open(f.fileno(), "w", encoding="utf-8", newline="", closefd=False) as text:
+        write_csv_chunks(df, text, start, end, notes, chunk_rows)
+    f.seek(0)
+    return f
+
+
+def validate(chunk):
+    # 回傳 (合格的記錄, 不合格筆數)
+    raw = len(chunk)
+    df = clean_history(chunk.copy(), COLUMNS)
+    # 空白或認不得的音符 (登錄表以外) 在 clean_history 後是缺值
+    df = df[df['Note_Type'].notna()]
+    df = df[df['BPM'].between(*BPM_RANGE) & (df['Duration'] > 0) & (df['Duration'] <= MAX_DURATION)]
+    df['Focus'] = df['Focus'].fillna("")
+    return df, raw - len(df)
+
+
+def import_csv(log, sources, chunk_rows=CHUNK_ROWS):
+    # sources：路徑或檔案物件；已存在的記錄 (時間 + 音符 + 時長相同) 與檔案間重複的都會略過
+    existing = log.read(['Date', 'Note_Type', 'Duration'])
+    seen = np.unique(row_keys(existing).to_numpy()) if not existing.empty else np.zeros(0, dtype=np.uint64)
+    del existing
+    summary = {"read": 0, "imported": 0, "duplicates": 0, "invalid": 0}
+    for source in sources:
+        for chunk in pd.read_csv(source, chunksize=chunk_rows, usecols=lambda c: c in COLUMNS, dtype=str):
+            summary["read"] += len(chunk)
+            df, invalid = validate(chunk)
+            summary["invalid"] += invalid
+            if df.empty:
+                continue
+            keys = row_keys(df).to_numpy()
+            # 同一塊內的重複只留第一筆，再排除已看過的
+            _, first = np.unique(keys, return_index=True)
+            keep = np.zeros(len(df), dtype=bool)
+            keep[first] = True
+            keep &= ~np.isin(keys, seen)
+            summary["duplicates"] += len(df) - int(keep.sum())
+            if not keep.any():
+                continue
+            log.append_frame(df[keep].sort_values('Date', kind='stable'))
+            seen = np.union1d(seen, keys[keep])
+            summary["imported"] += int(keep.sum())
+    return summary
+
+
+if __name__ == "__main__":
+    # python transfer.py import rap_log_v8.csv rap_log_v3.csv rap_log_v5.csv
+    # python transfer.py export rap_log_v8.csv out.csv [開始日期] [結束日期]
+    if len(sys.argv) < 4 or sys.argv[1] not in ("import", "export"):
+        print("usage: python transfer.py import <log.csv|log.arrow> <in.csv> [<in.csv> ...]\n"
+              "       python transfer.py export <log.csv|log.arrow> <out.csv> [start] [end]")
+        sys.exit(1)
+    log = SessionLog(sys.argv[2])
+    if sys.argv[1] == "import":
+        print(import_csv(log, sys.argv[3:]))
+        log.compact()
+    else:
+        start, end = (sys.argv[4:6] + [None, None])[:2]
+        with open(sys.argv[3], "w", encoding="utf-8", newline="") as out:
+            count = write_csv_chunks(log.read(), out, start, end)
+        print(f"exported {count} sessions -> {sys.argv[3]}")
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+import notes
+import telemetry
+
+# --- 趨勢圖資料 ---
+# 依時間跨度分桶 (日/週/月)，每桶算最高與平均，再做滾動視窗；
+# 點數超過預算時用 LTTB 挑點，圖表大小不會隨歷史筆數成長
+POINT_BUDGET = 200
+ROLLING_BUCKETS = 4
+# 跨度 (天) 上限 -> 分桶
+BUCKET_RULES = [(366, 'D'), (5 * 366, 'W'), (None, 'M')]
+BUCKET_NAMES = {'D': "日", 'W': "週", 'M': "月"}
+
+
+def bucket_freq(start, end):
+    span = int((np.datetime64(end, 'D') - np.datetime64(start, 'D')).astype(np.int64))
+    for limit, freq in BUCKET_RULES:
+        if limit is None or span <= limit:
+            return freq
+
+
+def bucket_starts(days, freq):
+    # datetime64[D] -> 所屬桶的起始日 (週一 / 每月 1 日)
+    if freq == 'D':
+        return days
+    if freq == 'W':
+        return days - ((days.astype(np.int64) + 3) % 7)  # 1970-01-01 是星期四
+    return days.astype('datetime64[M]').astype('datetime64[D]')
+
+
+@telemetry.timed("trends.bucket_stats")
+def bucket_stats(df, note=None, freq=None):
+    # 回傳以桶起始日為索引的 DataFrame：BPM / SPS 的滾動最高與滾動平均
+    columns = ['max_bpm', 'mean_bpm', 'max_sps', 'mean_sps']
+    df = df[notes.mask(df['Note_Type'], note)] if note is not None else df
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    days = df['Date'].to_numpy().astype('datetime64[D]')
+    freq = freq or bucket_freq(days.min(), days.max())
+    grouped = pd.DataFrame({
+        'bucket': bucket_starts(days, freq),
+        'BPM': df['BPM'].to_numpy(dtype=np.float64),
+        'SPS': df['SPS'].to_numpy(dtype=np.float64),
+    }).groupby('bucket', sort=True).agg(
+        max_bpm=('BPM', 'max'), bpm_sum=('BPM', 'sum'),
+        max_sps=('SPS', 'max'), sps_sum=('SPS', 'sum'), n=('BPM', 'size'))
+    rolling = grouped.rolling(ROLLING_BUCKETS, min_periods=1)
+    sums = rolling[['bpm_sum', 'sps_sum', 'n']].sum()
+    out = pd.DataFrame({
+        'max_bpm': rolling['max_bpm'].max(),
+        'mean_bpm': sums['bpm_sum'] / sums['n'],
+        'max_sps': rolling['max_sps'].max(),
+        'mean_sps': sums['sps_sum'] / sums['n'],
+    })
+    out.index = pd.DatetimeIndex(out.index, name=BUCKET_NAMES[freq])
+    return out
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets：保留 threshold 個點的索引 (含頭尾)，盡量維持曲線形狀
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一桶的平均點 (最後一桶用終點)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        picked[i + 1] = a
+    return picked
+
+
+@telemetry.timed("trends.downsample")
+def downsample(stats, column, budget=POINT_BUDGET):
+    # 以 column 挑點，其他欄位取同樣的列
+    if len(stats) <= budget:
+        return stats
+    x = stats.index.asi8.astype(np.float64)
+    return stats.iloc[lttb(x, stats[column].to_numpy(), budget)]
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+# --- 多使用者分區 ---
+# 每位訓練者一個資料夾：users/<分區>/rap_log_v8.csv (+ 日誌、同步佇列)
+# 讀取/統計只碰自己的分區，不同使用者存檔寫的是不同檔案，互不阻塞
+USERS_DIR = "users"
+INDEX_NAME = "index.json"
+
+
+def partition_id(user):
+    # 名稱可讀的部分 + 雜湊，大小寫或符號不同的名字也不會撞在一起
+    slug = re.sub(r"[^a-z0-9]+", "-", user.lower()).strip("-")[:24] or "user"
+    return f"{slug}-{hashlib.sha1(user.encode('utf-8')).hexdigest()[:8]}"
+
+
+# 使用者 -> 分區 的索引 (users/index.json)
+# 分區名稱由使用者名稱決定，索引只是查表與列出使用者用；
+# 就算兩個程序同時新增使用者而少寫一筆，下次存取時會再補上，資料不會錯放
+class UserDirectory:
+    def __init__(self, root=USERS_DIR):
+        self.root = root
+        self.index_file = os.path.join(root, INDEX_NAME)
+        self._lock = threading.Lock()
+        self._users = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self.index_file, encoding="utf-8") as f:
+                return json.load(f).get("users", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        # 暫存檔名每次不同：兩個程序同時新增使用者不會寫進同一個暫存檔
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"users": self._users}, f, ensure_ascii=False, indent=2, sort_keys=True)
+            os.replace(tmp, self.index_file)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def users(self):
+        return sorted(self._users)
+
+    def partition(self, user):
+        # 回傳該使用者的分區代號；第一次出現時建立資料夾並寫進索引
+        pid = self._users.get(user)
+        if pid is not None:
+            return pid
+        with self._lock:
+            pid = self._users.get(user)
+            if pid is None:
+                pid = partition_id(user)
+                os.makedirs(os.path.join(self.root, pid), exist_ok=True)
+                self._users = {**self._read_index(), user: pid}
+                self._write_index()
+            return pid
+
+    def folder(self, user):
+        return os.path.join(self.root, self.partition(user))
+
+    def remote_prefix(self, user):
+        # GitHub 上的路徑一律用 /
+        return f"{USERS_DIR}/{self.partition(user)}"